@@ -0,0 +1,42 @@
+#Memory held by a cached article once every section has been read, and once read all at once (all command)
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import wikibot
+from bench_parse import make_long_article, make_disambig_page
+
+#Total size of object and everything reachable from it through containers, counting shared objects once
+def deep_size(obj, seen=None):
+    seen = set() if seen == None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+def measure(name, extract, disambig):
+    article = wikibot.parse_article({"name": name, "extract": extract, "disambig": disambig})
+    article.pop("extract")
+    parsed = deep_size(article)
+    for i in range(len(article["sections"])):
+        wikibot.get_section(article, i)
+    sections = deep_size(article)
+    wikibot.get_all_text(article)
+    return parsed, sections, deep_size(article)
+
+def main():
+    cases = [("long article", "Long", make_long_article(), False),
+             ("long article, non-latin-1 text", "Long", make_long_article().replace(", again", " – again"), False),
+             ("disambiguation page", "Mercury", make_disambig_page(), True)]
+
+    for label, name, extract, disambig in cases:
+        parsed, sections, whole = (size / 1e6 for size in measure(name, extract, disambig))
+        print(f"{label} ({len(extract) // 1000} kB): parsed {parsed:.2f} MB, all sections read {sections:.2f} MB, "
+              f"all command {whole:.2f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#Parse throughput benchmark: single-pass tokenizer vs. the previous multi-pass regex parser
+import os, sys, re, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import wikibot
+
+#Number of timed runs per parser. The best run is reported
+runs = 20
+
+#
+# Previous parser, kept here for comparison
+#
+
+def legacy_get_disambig_links(extract, title):
+    extract = extract.split("==.?See also.?==")[0].strip()
+    link_parts = re.split(r"(?<=\n)(?!\=)(.+?)(?=,|\n)", extract)
+
+    new_links = []
+    for i in range(1, len(link_parts), 2):
+        page_name = re.sub('"|“|”', '', link_parts[i])
+        if page_name.lower() == title.lower():
+            new_match = re.search(r",(.+?)(?=,|\n)", link_parts[i + 1])
+            page_name += new_match.group() if new_match else ""
+
+        new_links += [page_name]
+        link_parts[i] = f"{str(len(new_links))}. {link_parts[i]}"
+
+    return "".join(link_parts), new_links
+
+def legacy_organize_sections(extract):
+    sect_parts = ["Introduction"] + re.split(r"(?<!\=)==(?!\=)", extract)
+
+    new_toc = []
+    new_sections = []
+    for i in range(0, len(sect_parts), 2):
+        sect_title = sect_parts[i].strip()
+        if "See also" in sect_title or "References" in sect_title:
+            break
+
+        sect_text = sect_parts[i + 1].strip()
+        sect_text = legacy_format_headers(sect_text, "===", "bold sans")
+        sect_text = legacy_format_headers(sect_text, "====", "bold italic sans")
+
+        new_toc += [sect_title]
+        new_sections += [wikibot.stylize_text(sect_title.upper(), "bold serif") + "\n\n" + sect_text]
+
+    return new_toc, new_sections
+
+def legacy_format_headers(extract, delimiter, style):
+    sub_parts = re.split(f"(?<!\\=){delimiter}(?!\\=)", extract)
+
+    for i in range(len(sub_parts)):
+        sub_parts[i] = sub_parts[i].strip()
+        if i % 2 == 1:
+            sub_parts[i] = "\n" + wikibot.stylize_text(sub_parts[i], style)
+        elif i > 0 and sub_parts[i] == "":
+            sub_parts[i] = wikibot.stylize_text("-subsection contains no text-", "italic sans")
+
+    return "\n".join(sub_parts)
+
+def legacy_parse(name, extract, disambig):
+    if disambig:
+        extract, links = legacy_get_disambig_links(extract, name)
+    return legacy_organize_sections(extract)
+
+#Current parser, including formatting every section so both sides do the same work
+def current_parse(name, extract, disambig):
+    article = wikibot.parse_article({"name": name, "extract": extract, "disambig": disambig})
+    return [wikibot.get_section(article, i) for i in range(len(article["sections"]))]
+
+#
+# Synthetic articles
+#
+
+#Long article with nested subsections
+def make_long_article(sections=60, subsections=4, paragraphs=3):
+    paragraph = "The quick brown fox jumps over the lazy dog, again and again, for 1,234 years. " * 8
+    text = paragraph * paragraphs
+    for i in range(sections):
+        text += f"\n\n\n== Section {i} ==\n" + paragraph * paragraphs
+        for j in range(subsections):
+            text += f"\n\n\n=== Subsection {i}.{j} ===\n" + paragraph * paragraphs
+            text += f"\n\n\n==== Detail {i}.{j} ====\n" + paragraph
+    return text + "\n\n\n== See also ==\n\n\n== References =="
+
+#Disambiguation page with many links
+def make_disambig_page(groups=40, links=25):
+    text = "Mercury may refer to:"
+    for i in range(groups):
+        text += f"\n\n\n== Group {i} ==\n"
+        text += "".join(f"Mercury {i}-{j}, a thing in group {i}\n" for j in range(links))
+    return text + "\n\n\n== See also ==\nMercurial"
+
+#Best time in seconds of fn over all runs
+def best_time(fn, *args):
+    best = float("inf")
+    for i in range(runs):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    cases = [("long article", "Long", make_long_article(), False),
+             ("disambiguation page", "Mercury", make_disambig_page(), True)]
+
+    for label, name, extract, disambig in cases:
+        legacy = best_time(legacy_parse, name, extract, disambig)
+        current = best_time(current_parse, name, extract, disambig)
+        size = len(extract) / 1e6
+        print(f"{label} ({len(extract) // 1000} kB): legacy {size / legacy:.1f} MB/s, current {size / current:.1f} MB/s "
+              f"({legacy / current:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#Microbenchmarks for the parsing, chunking and styling hot paths, run on the API responses saved in fixtures/. Reports throughput
+#and allocations per function and compares them with baseline.json. Pass --save to replace the baseline with the current figures
+import os, sys, gzip, json, time, tracemalloc
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(bench_dir, ".."))
+import wikibot
+
+fixtures_dir = os.path.join(bench_dir, "fixtures")
+baseline_path = os.path.join(bench_dir, "baseline.json")
+
+#Number of timed runs per benchmark. The best run is reported
+runs = 15
+
+#How far throughput may drop, or peak allocations grow, past the baseline before it's flagged as a regression
+time_tolerance = 0.15
+alloc_tolerance = 0.10
+
+#Session used for load_sect and rendering
+bench_user = "bench"
+
+#Load saved API response into the raw article dict fetch_article builds
+def load_fixture(path):
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        page = list(json.load(file)["query"]["pages"].values())[0]
+
+    return {"name": page["title"], "extract": page["extract"], "disambig": "pageprops" in page}
+
+#Parse raw article and start a session on it
+def parsed(raw):
+    article = wikibot.parse_article(dict(raw))
+    wikibot.wiki_data[bench_user] = wikibot.Session(article["name"], wikibot.default_limit, article)
+    return article
+
+#
+# Benchmarks. Each takes a raw article and returns the function to time, or None if it doesn't apply to the fixture
+#
+
+def bench_tokenize_extract(raw):
+    return lambda: wikibot.tokenize_extract(raw["extract"], raw["disambig"])
+
+def bench_get_disambig_links(raw):
+    if not raw["disambig"]:
+        return None
+
+    tree = wikibot.tokenize_extract(raw["extract"], True)
+    return lambda: wikibot.get_disambig_links(raw["extract"], raw["name"], tree)
+
+def bench_organize_sections(raw):
+    tree = wikibot.tokenize_extract(raw["extract"], raw["disambig"])
+    numbered = wikibot.get_disambig_links(raw["extract"], raw["name"], tree)[1] if raw["disambig"] else ()
+    return lambda: wikibot.organize_sections(raw["extract"], tree, numbered)
+
+def bench_format_headers(raw):
+    article = parsed(raw)
+    sections = list(zip(article["sections"], article["headers"]))
+    return lambda: [wikibot.format_headers(text, headers) for text, headers in sections]
+
+#Every section in turn, then the whole article (all command), formatting from scratch each run
+def bench_load_sect(raw):
+    article = parsed(raw)
+
+    def run():
+        article.pop("formatted", None)
+        article.pop("all", None)
+        for number in range(len(article["sections"])):
+            wikibot.load_sect(number, bench_user)
+        wikibot.load_sect(-1, bench_user)
+
+    return run
+
+def bench_stylize_text(raw):
+    return lambda: wikibot.stylize_text(raw["extract"], "bold sans")
+
+#Every chunk of the whole article as get_current sends it, with its style spans applied
+def bench_render_chunks(raw):
+    parsed(raw)
+    wikibot.load_sect(-1, bench_user)
+    session = wikibot.wiki_data[bench_user]
+    return lambda: [wikibot.render_chunk(session.text, session.spans, start, end) for start, end in session.chunks]
+
+benchmarks = [bench_tokenize_extract, bench_get_disambig_links, bench_organize_sections, bench_format_headers, bench_load_sect,
+              bench_stylize_text, bench_render_chunks]
+
+#
+# Measurement
+#
+
+#Fixed pure-Python workload (regex scan, string building, dict lookups) timed in turn with each benchmark. Throughput is compared
+#with the baseline relative to how fast this runs, so the baseline carries over between machines and changes in load on this one
+def calibration():
+    text = " ".join(f"word{i % 97} Header {i}\n" for i in range(5000))
+    def run():
+        counts = {}
+        for match in wikibot.word_regex.finditer(text):
+            counts[match.group()] = counts.get(match.group(), 0) + 1
+        return "".join(key.upper() for key in counts)
+    return run
+
+#Best times in seconds of fn and of the calibration workload over all runs, alternating between the two
+def best_times(fn, calibrate):
+    best = [float("inf"), float("inf")]
+    for i in range(runs):
+        for j, run in enumerate((fn, calibrate)):
+            start = time.perf_counter()
+            run()
+            best[j] = min(best[j], time.perf_counter() - start)
+    return best
+
+#Peak memory allocated while fn runs, and memory still held afterwards (results & memoized values), in bytes
+def allocations(fn):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - before, current - before
+
+#Run every benchmark on every fixture. Returns {"fixture/function": {"mb_s", "calibration_ms", "peak_kb", "held_kb"}}. Throughput
+#is in MB of extract text per second, so figures are comparable across functions
+def measure():
+    calibrate = calibration()
+    results = {}
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        raw = load_fixture(os.path.join(fixtures_dir, file_name))
+        size = len(raw["extract"]) / 1e6
+
+        for bench in benchmarks:
+            fn = bench(raw)
+            if fn == None:
+                continue
+
+            peak, held = allocations(fn)
+            key = file_name.split(".")[0] + "/" + bench.__name__[len("bench_"):]
+            seconds, calibration_s = best_times(fn, calibrate)
+            results[key] = {"mb_s": round(size / seconds, 2), "calibration_ms": round(calibration_s * 1000, 3),
+                            "peak_kb": round(peak / 1e3, 1), "held_kb": round(held / 1e3, 1)}
+
+    return results
+
+#Print figures next to the baseline's, flagging regressions. Baseline throughput is scaled to the current speed by the ratio of
+#calibration times taken alongside each benchmark. Returns number of regressions
+def compare(results, baseline):
+    regressions = 0
+    print(f"{'benchmark':44} {'MB/s':>8} {'base':>8} {'peak kB':>10} {'base':>10} {'held kB':>10}")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base != None and "calibration_ms" in base:
+            base = dict(base, mb_s=base["mb_s"] * base["calibration_ms"] / result["calibration_ms"])
+        notes = []
+        if base != None:
+            if result["mb_s"] < base["mb_s"] * (1 - time_tolerance):
+                notes += ["SLOWER"]
+            if result["peak_kb"] > base["peak_kb"] * (1 + alloc_tolerance):
+                notes += ["MORE MEMORY"]
+        else:
+            notes += ["new"]
+
+        regressions += "new" not in notes and len(notes)
+        base_mb_s, base_peak = (f"{base['mb_s']:.2f}", f"{base['peak_kb']:.1f}") if base != None else ("-", "-")
+        print(f"{key:44} {result['mb_s']:8.2f} {base_mb_s:>8} {result['peak_kb']:10.1f} {base_peak:>10} {result['held_kb']:10.1f}  "
+              + " ".join(notes))
+
+    return regressions
+
+def main():
+    results = measure()
+
+    if "--save" in sys.argv:
+        with open(baseline_path, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved baseline of {len(results)} benchmarks to {baseline_path}")
+        return 0
+
+    try:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+    except OSError:
+        baseline = {}
+
+    regressions = compare(results, baseline)
+    print(f"\n{regressions} regression(s) against baseline")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+#Refresh benchmark fixtures with live API responses, requested the same way fetch_article does. Re-save the benchmark baseline
+#afterwards (bench_suite.py --save), since figures change with the pages
+import os, sys, gzip, json
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(bench_dir, ".."))
+import wikibot
+
+#Fixture name: page title. A very long article, one with deeply nested headers, and a large disambiguation page
+fixture_titles = {"long_article": "World War II",
+                  "nested_headers": "Outline of physics",
+                  "large_disambiguation": "Mercury"}
+
+def main():
+    for name, title in fixture_titles.items():
+        req = wikibot.api_session.get(wikibot.wiki_url, timeout=wikibot.api_timeout, params={
+            "action": "query",
+            "format": "json",
+            "redirects": "1",
+            "prop": "extracts|pageprops|info",
+            "ppprop": "disambiguation",
+            "explaintext": "1",
+            "titles": title})
+        req.raise_for_status()
+
+        path = os.path.join(bench_dir, "fixtures", name + ".json.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            json.dump(req.json(), file, ensure_ascii=False)
+        print(f"Saved {title} to {path}")
+
+if __name__ == "__main__":
+    main()
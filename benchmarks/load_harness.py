@@ -0,0 +1,301 @@
+#End-to-end load test: simulated direct & group chats write messages into a synthetic chat.db at a fixed rate while the bot runs
+#against a local stub of api.php, and replies are captured by a stand-in for the osascript sender. Reports throughput and reply
+#latency. Pass several comma-separated --chats values to find where latency starts to degrade, e.g.
+#    python3 benchmarks/load_harness.py --chats 100,1000,5000 --rate 200
+import os, sys, gzip, json, time, random, argparse, tempfile, threading, sqlite3, subprocess
+import http.server, urllib.parse
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(bench_dir, ".."))
+import wikibot
+
+#Commands sent after a chat's first search, with relative weights
+followups = {"next": 70, "previous": 5, "toc": 5, "sect 2": 5, "part 3": 3, "all": 2, "1": 5, "ping": 5}
+
+#
+# Synthetic chat.db
+#
+
+#Create chat.db with the tables & columns sql_get_new reads, plus one handle per simulated chat
+def make_chat_db(path, people):
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE handle (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT)")
+    db.execute("CREATE TABLE message (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT, handle_id INTEGER, is_from_me INTEGER,"
+               " cache_roomnames TEXT, date INTEGER)")
+    db.executemany("INSERT INTO handle (id) VALUES (?)", [(f"+1555{i:07d}",) for i in range(people)])
+    db.commit()
+    return db
+
+#Simulated chat: the handle it writes as, its group room name (None for direct chats), and the chat ID the bot will reply to
+class Chat:
+    def __init__(self, handle_rowid, handle, room):
+        self.handle_rowid = handle_rowid
+        self.room = room
+        self.user = wikibot.group_chat_prefix + room if room else wikibot.direct_chat_prefix + handle
+        self.started = False
+
+    #First message searches for a page, later ones navigate it
+    def next_message(self, rng, titles, weights):
+        if not self.started or rng.random() < 0.02:
+            self.started = True
+            return "get " + rng.choices(titles, weights)[0]
+        return rng.choices(list(followups), list(followups.values()))[0]
+
+#
+# Stub api.php
+#
+
+#Canned extracts from benchmark fixtures, plus a short article. Every title is a page, using a canned extract picked by title
+def load_extracts():
+    extracts = [("Short article intro.\n\n\n== History ==\nSome history.\n\n\n=== Early ===\nEarly days.\n\n\n== See also ==", False)]
+    fixtures_dir = os.path.join(bench_dir, "fixtures")
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        with gzip.open(os.path.join(fixtures_dir, file_name), "rt", encoding="utf-8") as file:
+            page = list(json.load(file)["query"]["pages"].values())[0]
+        extracts += [(page["extract"], "pageprops" in page)]
+    return extracts
+
+#Serve TextExtracts, page info and section list queries on localhost, answering after api_delay seconds. Returns the endpoint URL
+def start_stub(api_delay, extracts):
+    #Section list in the form the API's parse action gives, for the page's canned extract
+    def parse_sections(title):
+        name = wikibot.normalize_title(title)
+        pageid = sum(name.encode()) * 7919 + len(name)
+        extract = extracts[pageid % len(extracts)][0]
+        return {"title": name, "pageid": pageid, "sections": [
+            {"toclevel": len(match["eq"]) - 1, "level": str(len(match["eq"])), "line": match["head"].strip()}
+            for match in wikibot.header_regex.finditer(extract)]}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+            if params.get("action") == "parse":
+                return self.reply({"parse": parse_sections(params["page"])})
+
+            query = {"pages": {}}
+            for title in params.get("titles", "").split("|"):
+                name = wikibot.normalize_title(title)
+                if name != title:
+                    query.setdefault("normalized", []).append({"from": title, "to": name})
+
+                pageid = sum(name.encode()) * 7919 + len(name)
+                extract, disambig = extracts[pageid % len(extracts)]
+                page = {"pageid": pageid, "ns": 0, "title": name, "touched": "2025-01-01T00:00:00Z", "lastrevid": pageid,
+                        "length": int(len(extract.encode()) / wikibot.text_per_wikitext)}
+                if "extracts" in params.get("prop", ""):
+                    page["extract"] = extract.split("\n==")[0].rstrip() if "exintro" in params else extract
+                if disambig:
+                    page["pageprops"] = {"disambiguation": ""}
+                query["pages"][str(pageid)] = page
+
+            self.reply({"batchcomplete": "", "query": query})
+
+        def reply(self, data):
+            body = json.dumps(data).encode()
+            time.sleep(api_delay)
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/w/api.php"
+
+#
+# Capture transport
+#
+
+#Replies received per chat, as capture times in order
+replies = {}
+replies_lock = threading.Lock()
+
+#Stand-in for the osascript sender: records when each reply was handed over, taking send_delay seconds per batch
+def make_capture_send(send_delay):
+    def capture_send(batch):
+        time.sleep(send_delay)
+        now = time.time()
+        with replies_lock:
+            for user, text in batch:
+                replies.setdefault(user, []).append(now)
+        return [True] * len(batch)
+
+    return capture_send
+
+#Messages handled per chat, in order, as (number of messages, whether a reply was sent). A burst of coalesced navigation
+#commands is several messages answered by one reply
+handled = {}
+handled_local = threading.local()
+
+#Wrap handle_message & send_message to record how many messages each reply answers
+def track_handling():
+    handle_message = wikibot.handle_message
+    send_message = wikibot.send_message
+
+    def tracked_handle_message(text, user, burst=()):
+        handled_local.replied = False
+        handle_message(text, user, burst)
+        with replies_lock:
+            handled.setdefault(user, []).append((1 + len(burst), handled_local.replied))
+
+    def tracked_send_message(response, user):
+        handled_local.replied = True
+        send_message(response, user)
+
+    wikibot.handle_message = tracked_handle_message
+    wikibot.send_message = tracked_send_message
+
+#
+# Load run
+#
+
+#Sorted list's value at quantile q
+def percentile(values, q):
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0
+
+#Run one load level in this process and return its results
+def run(args):
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="wikibot_load_")
+    db = make_chat_db(os.path.join(work_dir, "chat.db"), args.chats)
+
+    #Direct chats, then group chats. Replies to a group go to its room whoever writes, so one member per group is enough
+    direct = args.chats - args.groups
+    chats = [Chat(i + 1, f"+1555{i:07d}", None if i < direct else f"chat{i - direct:06d}") for i in range(args.chats)]
+
+    #Pages with Zipf-like popularity, so popular ones stay cached while the long tail misses
+    titles = [f"Load test page {i}" for i in range(args.pages)]
+    weights = [1 / (i + 1) for i in range(args.pages)]
+
+    wikibot.chat_db_path = os.path.join(work_dir, "chat.db")
+    wikibot.wiki_url = start_stub(args.api_delay, load_extracts())
+    wikibot.article_db_path = os.path.join(work_dir, "articles.db") if args.store else None
+    wikibot.session_db_path = None
+    wikibot.metrics_path = None
+    wikibot.max_workers = args.workers
+    wikibot.coalesce_bursts = not args.no_coalesce
+    wikibot.progressive_fetch = not args.no_progressive
+    wikibot.transports["capture"] = {"send": make_capture_send(args.send_delay)}
+    wikibot.transport_name = "capture"
+    track_handling()
+
+    sys.argv = ["wikibot.py"]
+    threading.Thread(target=wikibot.main, daemon=True).start()
+    time.sleep(1)
+
+    #Write messages at the configured rate in small batches, remembering when each chat's messages were written
+    sent = {}
+    start = time.time()
+    tick = 0.05
+    total = 0
+    while time.time() - start < args.duration:
+        due = int((time.time() - start) * args.rate) - total
+        rows = []
+        for i in range(due):
+            chat = rng.choice(chats)
+            now = time.time()
+            rows += [(chat.next_message(rng, titles, weights), chat.handle_rowid, chat.room, int((now - wikibot.apple_epoch) * 1e9))]
+            sent.setdefault(chat.user, []).append(now)
+
+        if rows:
+            db.executemany("INSERT INTO message (text, handle_id, is_from_me, cache_roomnames, date) VALUES (?, ?, 0, ?, ?)", rows)
+            db.commit()
+            total += len(rows)
+        time.sleep(tick)
+    send_end = time.time()
+
+    #Wait for every message to be handled and its reply captured
+    deadline = time.time() + args.drain
+    while time.time() < deadline:
+        with replies_lock:
+            done = sum(count for entries in handled.values() for count, replied in entries)
+            expected = sum(replied for entries in handled.values() for count, replied in entries)
+            received = sum(len(times) for times in replies.values())
+        if done >= total and received >= expected:
+            break
+        time.sleep(0.1)
+
+    #Replies to a chat arrive in the order its messages were handled. Latency runs from the first message a reply answers
+    latencies = []
+    with replies_lock:
+        for user, entries in handled.items():
+            position = 0
+            reply_times = iter(replies.get(user, []))
+            for count, replied in entries:
+                reply = next(reply_times, None) if replied else None
+                if reply != None:
+                    latencies += [reply - sent[user][position]]
+                position += count
+        last_reply = max((times[-1] for times in replies.values()), default=send_end)
+        answered = sum(count for entries in handled.values() for count, replied in entries if replied)
+    latencies.sort()
+
+    #Per-stage figures from the bot's own metrics
+    report = wikibot.get_metrics()
+    stages = {name: [wikibot.quantile(hist, 0.5), wikibot.quantile(hist, 0.99)] for name, hist in report["histograms"].items()}
+
+    return {"chats": args.chats, "groups": args.groups, "rate": args.rate, "sent": total, "answered": answered, "replies": len(latencies),
+            "throughput": answered / (last_reply - start), "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else 0, "stages": stages}
+
+def print_result(result):
+    print(f"{result['chats']} chats ({result['groups']} group), {result['rate']} msg/s: sent {result['sent']}, "
+          f"answered {result['answered']} with {result['replies']} replies, {result['throughput']:.1f} messages/s")
+    print(f"  reply latency p50 {wikibot.format_seconds(result['p50'])}, p99 {wikibot.format_seconds(result['p99'])}, "
+          f"max {wikibot.format_seconds(result['max'])}")
+    for name, (p50, p99) in sorted(result["stages"].items()):
+        print(f"  {name}: p50 {wikibot.format_seconds(p50)}, p99 {wikibot.format_seconds(p99)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Wikibot end-to-end load harness")
+    parser.add_argument("--chats", default="1000", help="number of simulated chats, or comma-separated list to run each in turn")
+    parser.add_argument("--group-share", type=float, default=0.1, help="fraction of chats that are group chats")
+    parser.add_argument("--rate", type=float, default=100, help="messages written per second, across all chats")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to keep writing messages")
+    parser.add_argument("--drain", type=float, default=30, help="max seconds to wait for outstanding replies afterwards")
+    parser.add_argument("--pages", type=int, default=500, help="number of distinct pages searched for")
+    parser.add_argument("--api-delay", type=float, default=0.1, help="stub api.php response time in seconds")
+    parser.add_argument("--send-delay", type=float, default=0.02, help="sender time per batch in seconds")
+    parser.add_argument("--workers", type=int, default=wikibot.max_workers, help="worker threads (max_workers)")
+    parser.add_argument("--no-coalesce", action="store_true", help="answer every queued navigation command separately")
+    parser.add_argument("--no-progressive", action="store_true", help="fetch whole articles before replying to searches")
+    parser.add_argument("--store", action="store_true", help="use an on-disk article store")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    levels = [int(chats) for chats in args.chats.split(",")]
+
+    #Several levels: run each in a fresh process, since the bot's loop can't be stopped
+    if len(levels) > 1:
+        argv = sys.argv[1:]
+        if "--chats" in argv:
+            index = argv.index("--chats")
+            argv = argv[:index] + argv[index + 2:]
+        argv = [arg for arg in argv if not arg.startswith("--chats=")]
+
+        for chats in levels:
+            output = subprocess.run([sys.executable, __file__, "--chats", str(chats), "--json"] + argv,
+                                    capture_output=True, text=True).stdout
+            print_result(json.loads(output.strip().splitlines()[-1]))
+        return
+
+    args.chats = levels[0]
+    args.groups = int(args.chats * args.group_share)
+    result = run(args)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_result(result)
+
+    #Worker threads block interpreter exit, and there's nothing left to clean up
+    sys.stdout.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#Generate synthetic benchmark fixtures, for when the live API can't be reached (see fetch_fixtures.py for real responses). Pages are
+#seeded filler text shaped like TextExtracts output: a long article, one with deeply nested headers, and a large disambiguation
+#page. Titles and page IDs are made up so they can't be mistaken for real pages. Re-save the baseline afterwards (bench_suite.py --save)
+import os, gzip, json, random
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+
+rng = random.Random(17)
+
+#Filler vocabulary, plus names with non-ASCII characters so styling & chunking see multi-byte text
+words = ("the of and in to a was is for as on by with from that at his which an were are it be this its had also has "
+         "first after city new war state government army during their two one other who not been more century between river "
+         "population north south region national empire university king party later system early since under while period "
+         "church world area french german british modern years into over most within several many including known water "
+         "president council battle treaty trade economic culture language republic island province coast during these").split()
+names = ["Kraków", "São Paulo", "Zürich", "Montréal", "Ōsaka", "Reykjavík", "Córdoba", "Łódź", "Düsseldorf", "Málaga",
+         "Nikola Tesla", "Marie Curie", "Émile Zola", "Antonín Dvořák", "Frédéric Chopin", "Søren Kierkegaard"]
+
+#Closing sections that arrive empty, as in real extracts
+end_sections = "\n\n\n== See also ==\n\n\n== Notes ==\n\n\n== References ==\n\n\n== Further reading ==\n\n\n== External links =="
+
+#Fixture name: (title, page ID, disambiguation flag). Page IDs are far past any real ones
+fixture_pages = {"long_article": ("Synthetic long article", 900000001, False),
+                 "nested_headers": ("Synthetic nested headers", 900000002, False),
+                 "large_disambiguation": ("Synthetic disambiguation", 900000003, True)}
+
+#Sentence of filler words, with the odd name, year range, area figure, or quote
+def sentence():
+    n = rng.randint(8, 28)
+    sent = [rng.choice(words) for i in range(n)]
+    if rng.random() < 0.3:
+        sent.insert(rng.randrange(n), rng.choice(names))
+    if rng.random() < 0.25:
+        sent.insert(rng.randrange(n), f"{rng.randint(1000, 2020)}–{rng.randint(10, 99)}")
+    if rng.random() < 0.2:
+        sent.insert(rng.randrange(n), f"({rng.randint(1, 999)},{rng.randint(100, 999)} km²)")
+
+    text = " ".join(sent)
+    if rng.random() < 0.15:
+        text += f", described as “{rng.choice(words)} {rng.choice(words)}”"
+    return text[0].upper() + text[1:] + "."
+
+def paragraph(low=3, high=9):
+    return " ".join(sentence() for i in range(rng.randint(low, high)))
+
+def header_title():
+    return " ".join(rng.choice(words).capitalize() for i in range(rng.randint(1, 4)))
+
+#Long article: 45 sections with a few subsections each
+def long_article():
+    text = "\n".join(paragraph() for i in range(6))
+    for i in range(45):
+        text += f"\n\n\n== {header_title()} ==\n" + "\n".join(paragraph() for j in range(rng.randint(2, 5)))
+        for j in range(rng.randint(0, 6)):
+            text += f"\n\n\n=== {header_title()} ===\n" + "\n".join(paragraph() for k in range(rng.randint(1, 5)))
+            for k in range(rng.randint(0, 2)):
+                text += f"\n\n\n==== {header_title()} ====\n" + "\n".join(paragraph() for m in range(rng.randint(0, 3)))
+    return text + end_sections
+
+#Outline-style article: many short and empty subsections
+def nested_headers():
+    text = paragraph()
+    for i in range(30):
+        text += f"\n\n\n== {header_title()} ==\n" + (paragraph(1, 3) if rng.random() < 0.7 else "")
+        for j in range(rng.randint(3, 9)):
+            text += f"\n\n\n=== {header_title()} ===\n" + (paragraph(1, 3) if rng.random() < 0.6 else "")
+            for k in range(rng.randint(0, 7)):
+                text += f"\n\n\n==== {header_title()} ====\n" + (paragraph(1, 2) if rng.random() < 0.75 else "")
+    return text + end_sections
+
+#Disambiguation page: sections of one-line links, including placename links ("Title, Place") and quoted titles
+def large_disambiguation(title):
+    text = (f"{title} commonly refers to:\n\n{title} (planet), a planet\n{title} (element), a chemical element\n"
+            f"{title} (mythology), a god\n\n{title} may also refer to:")
+    for i in range(24):
+        text += f"\n\n\n== {header_title()} ==\n"
+        for j in range(rng.randint(8, 40)):
+            kind = rng.random()
+            if kind < 0.15:
+                text += f"{title}, {rng.choice(names)}, a {rng.choice(words)} {rng.choice(words)}\n"
+            elif kind < 0.3:
+                text += f"“{title}” ({rng.choice(['song', 'album', 'film', 'novel'])}), by {rng.choice(names)}, {rng.randint(1950, 2024)}\n"
+            else:
+                text += f"{title} {header_title()}, {sentence()[:-1].lower()}\n"
+        if rng.random() < 0.3:
+            text += f"\n\n\n=== {header_title()} ===\n" + "".join(f"{header_title()} {title}, a {rng.choice(words)} {rng.choice(words)}\n"
+                                                              for k in range(rng.randint(3, 12)))
+    return text + f"\n\n\n== See also ==\nAll pages with titles beginning with {title}\nAll pages with titles containing {title}"
+
+#Wrap extract in a response shaped like the one fetch_fixtures.py saves
+def response(pageid, title, extract, disambig):
+    page = {"pageid": pageid, "ns": 0, "title": title, "extract": extract, "contentmodel": "wikitext", "pagelanguage": "en",
+            "pagelanguagehtmlcode": "en", "pagelanguagedir": "ltr", "touched": "2025-01-01T00:00:00Z", "lastrevid": pageid,
+            "length": len(extract.encode()) * 2}
+    if disambig:
+        page["pageprops"] = {"disambiguation": ""}
+    return {"batchcomplete": "", "query": {"pages": {str(pageid): page}}}
+
+def main():
+    for name, (title, pageid, disambig) in fixture_pages.items():
+        extract = large_disambiguation(title) if disambig else globals()[name]()
+        path = os.path.join(bench_dir, "fixtures", name + ".json.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            json.dump(response(pageid, title, extract, disambig), file, ensure_ascii=False)
+        print(f"Saved {title} ({len(extract) / 1000:.0f} kB) to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 #Wikibot by Dylan G. (c) 2025
 import os, sys, re, time        #General stuff
+import struct                   #For reading the WAL index header
+import threading, collections   #For concurrent per-user processing
+import concurrent.futures
 import requests                 #For Wikipedia API
 import sqlite3, subprocess      #For iMessage I/O
+import json, queue, select      #For outbound message queue
+import random, bisect           #For retry jitter & chunk lookup
+import mmap, zlib, gzip         #For offline corpus
+import difflib, array           #For title index & suggestions
+import html                     #For section names from the API
 
 #Applescript has no protections against sending a message long enough to crash iMessage (lol). 11,000 is a safe but arbitrary choice.
 IMSG_HARD_LIMIT = 11000
@@ -22,86 +30,419 @@ chat_db_path = "~/Library/Messages/chat.db"
 direct_chat_prefix = "iMessage;-;"
 group_chat_prefix = "iMessage;+;"
 sql_max_rowid = "SELECT MAX(rowid) FROM message"
-sql_get_new = ("SELECT H.id, text, is_from_me, cache_roomnames"
+sql_max_rowid_before = "SELECT MAX(rowid) FROM message WHERE date < ?"
+sql_newest_date = "SELECT date FROM message ORDER BY rowid DESC LIMIT 1"
+sql_get_new = ("SELECT M.rowid, H.id, text, is_from_me, cache_roomnames, date"
                " FROM message M LEFT JOIN handle H"
                " ON H.rowid=M.handle_id"
-               " WHERE M.rowid=")
+               " WHERE M.rowid > ? ORDER BY M.rowid LIMIT ?")
+sql_get_parked = ("SELECT M.rowid, H.id, text, is_from_me, cache_roomnames, date"
+                  " FROM message M LEFT JOIN handle H"
+                  " ON H.rowid=M.handle_id"
+                  " WHERE M.rowid IN ({})")
 
-#User agent spoof; not actually needed for this API
-req_header = {"user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X x.y; rv:42.0) Gecko/20100101 Firefox/42.0"}
+#Max rows pulled per query, and how long a row that hasn't finished downloading is retried before giving up on it (seconds)
+ingest_batch_size = 500
+ingest_park_timeout = 300
+
+#How often chat.db and its -wal/-shm files are checked for changes while idle (seconds)
+watch_interval = 0.02
+
+#Fallback poll in case a change is missed. Starts at the minimum and doubles after each idle poll, up to the maximum (seconds)
+poll_min_delay = 0.5
+poll_max_delay = 5.0
+
+#chat.db message dates are nanoseconds since 2001-01-01, or seconds before macOS 10.13. Dates below apple_seconds_max are seconds
+apple_epoch = 978307200
+apple_seconds_max = 1e12
+
+#Ingestion state: "cursor" is the highest ROWID read so far, "parked" maps not-yet-ready ROWIDs to when they were first seen
+ingest_state = {"cursor": 0, "parked": {}}
+
+#Number of worker threads used to run commands for different chats at the same time. Chats waiting for a worker only cost a queue
+#entry, and a worker mostly waits on Wikipedia, so this can be well above the number of cores
+max_workers = 32
+
+#When a chat has several navigation commands queued back to back (e.g. "next" sent repeatedly over a slow link), they're run as one
+#burst with a single reply for where the last one ends up. Set to False to answer each one
+coalesce_bursts = True
+navigation_commands = {"next", "previous", "part", "section"}
 
-#Global variable that contains article data for all users, including this example entry
-wiki_data = {"Example User":
+#Outbound transport: "imessage" pipes replies to a long-lived osascript process, "file" appends them to outbox_path (for local testing)
+transport_name = "imessage"
+outbox_path = "wikibot_outbox.jsonl"
+
+#Failed sends are retried up to send_max_retries times, waiting send_retry_delay seconds between attempts. The sender process is
+#considered stuck if it doesn't acknowledge a message within send_timeout seconds
+send_max_retries = 3
+send_retry_delay = 0.5
+send_timeout = 10
+
+#Wikipedia API endpoint
+wiki_url = "https://en.wikipedia.org/w/api.php"
+
+#User agent spoof; not actually needed for this API
+req_header = {"user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X x.y; rv:42.0) Gecko/20100101 Firefox/42.0",
+              "accept-encoding": "gzip, deflate"}
+
+#API (connect, read) timeouts in seconds. Timeouts, connection errors, 429s and 5xx responses are retried up to api_max_retries times,
+#with jittered exponential backoff starting at api_retry_delay seconds (or the server's Retry-After, up to api_max_retry_after)
+api_timeout = (3.05, 10)
+api_max_retries = 2
+api_retry_delay = 0.5
+api_max_retry_after = 5
+
+#Circuit breaker: after api_breaker_threshold consecutive failed calls, API calls fail immediately for api_breaker_cooldown seconds
+api_breaker_threshold = 5
+api_breaker_cooldown = 30
+
+#Parsed articles shared by all users, keyed by resolved title (after redirects), including this example entry.
+#Least recently used entries are evicted past article_cache_size, and entries older than article_cache_ttl seconds are refetched
+article_cache_size = 200
+article_cache_ttl = 3600
+article_cache = collections.OrderedDict({"Example Article Title":
                 {"title": "Example Article Title",
+                 "name": "Example Article Title",
                  "toc": ["Introduction", "History"],
                  "sections": ["Example introduction", "Example of history section"],
-                 "section_num": 0,
-                 "chunks": ["Example introduction"],
-                 "chunk_num": 0,
-                 "limit": default_limit,
+                 "headers": [[], []],
                  "disambig": False,
-                 "links": ["Page link 1", "Page link 2", "Page link 3"]}}
+                 "links": ["Page link 1", "Page link 2", "Page link 3"],
+                 "time": 0}})
+
+#On-disk article store that survives restarts, keyed by page ID & revision. Set to None to disable
+article_db_path = "~/.wikibot_articles.db"
+article_db = None
+store_lock = threading.Lock()
+
+#Offline corpus of plain-text extracts, searched before the on-disk store and the API. Built from a dump with
+#"python3 wikibot.py ingest dump.jsonl" as corpus_path + ".dat" (compressed pages) and ".idx" (sorted title index, memory-mapped).
+#Dump lines are page objects as the API returns them (title, extract, pageprops) or redirects ({"title": ..., "redirect": target})
+corpus_path = "~/.wikibot_corpus"
+corpus = {}
+corpus_lock = threading.Lock()
+corpus_header = struct.Struct("<4sII")      #Magic, version, entry count
+corpus_entry = struct.Struct("<QIQII")      #Title offset & length (in titles blob), page offset & length (in .dat), flags
+corpus_redirect = 1
+
+#Local index of known titles (offline corpus and on-disk store), loaded at startup, for resolving case variants and suggesting the
+#closest titles as numbered choices when a search misses. Near misses need a similarity of at least suggestion_cutoff (0-1). If
+#title_index_complete is True, titles that aren't in the index are treated as missing without asking the API
+suggestion_count = 5
+suggestion_cutoff = 0.6
+title_index_complete = False
+title_index = {}
+title_index_lock = threading.Lock()
+
+#Titles last suggested to each chat, picked by replying with their number
+pending_suggestions = {}
+
+#Version of the parsed format saved in the on-disk store. Bump whenever parse_article output changes so stored articles are reparsed
+parse_version = 3
+
+#After landing on a disambiguation page, its first prefetch_count links are fetched into the shared cache in the background,
+#with at most prefetch_per_user fetches in flight per user
+prefetch_count = 5
+prefetch_per_user = 5
+prefetch_pool = concurrent.futures.ThreadPoolExecutor(4)
+prefetch_inflight = collections.Counter()
+prefetch_lock = threading.Lock()
+
+#Shared keep-alive connection pool for all Wikipedia calls, and circuit breaker state
+api_session = requests.Session()
+api_session.headers.update(req_header)
+api_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max_workers))
+api_session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max_workers))
+api_breaker = {"failures": 0, "open_until": 0}
+api_breaker_lock = threading.Lock()
+
+#Progressive fetch: a search first gets just the page info, introduction and section list, and replies right away. The full article
+#is fetched in the background once that reply is ready, so it doesn't compete with the first one. Commands that reach a section
+#that hasn't arrived yet wait up to progressive_wait seconds for it. Disambiguation pages are always fetched whole, since their first
+#reply shows the whole page. Section lists are fetched on their own pool so they never queue behind the slower background fetches of
+#full articles. Until the full article arrives, its size is estimated as text_per_wikitext times the page's wikitext length
+progressive_fetch = True
+progressive_wait = 30
+text_per_wikitext = 0.4
+fill_pool = concurrent.futures.ThreadPoolExecutor(8)
+section_pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+#Lookups of articles missing from the shared cache, keyed by normalized title. Concurrent lookups of the same title share one
+#in-flight fetch instead of each calling the API
+inflight_fetches = {}
+fetch_lock = threading.Lock()
+
+#Page info queries for different titles made within batch_window seconds of each other go out together as one multi-title query,
+#up to batch_max_titles per query. TextExtracts only returns one full-page extract per request, so only introduction queries are
+#batched, up to the intro_batch_max_titles extracts it returns at once
+batch_window = 0.02
+batch_max_titles = 50
+intro_batch_max_titles = 20
+query_batches = {}
+batch_lock = threading.Lock()
+
+#Maps normalized search titles to (resolved title, redirected) for looking up article_cache without an API call
+title_aliases = {"Example article title": ("Example Article Title", False)}
+cache_lock = threading.Lock()
+
+#Precompiled patterns for parsing TextExtracts plaintext. Headers are ==Title== through ====Title==== on their own line. Disambiguation
+#page links are non-header text (doesnt start with '=') that's preceded by a newline and followed by a newline, comma, or the end
+header_pattern = r"(?P<eq>={2,4})(?!=)(?P<head>.*?)(?<!=)(?P=eq)(?!=)"
+header_regex = re.compile(r"(?m)^" + header_pattern)
+header_link_regex = re.compile(r"(?m)^(?:" + header_pattern + r"|(?<=\n)(?!=)(?P<link>.[^,\n]*))")
+quotes_regex = re.compile('"|“|”')
+placename_regex = re.compile(r",(.+?)(?=,|\n)")
+
+#Words indexed and searched by the find command, which lists at most find_max_sections sections with matches
+word_regex = re.compile(r"\w+")
+find_max_sections = 10
+
+#User sessions (see SessionStore) are evicted after session_ttl seconds idle. Past session_memory_budget bytes of article text held by
+#sessions, least recently used sessions are spilled down to their title, position and limit, and rebuilt when next used
+session_ttl = 24 * 3600
+session_memory_budget = 64 * 1024 * 1024
+session_sweep_interval = 60
+
+#Chats allowed to use admin-only commands (stats), e.g. "iMessage;-;+15555550123". "local" is the CLI mode user
+admin_users = ["local"]
+
+#Latency histograms & counters for each stage of handling a message. Written to metrics_path (JSON) every metrics_interval seconds,
+#set to None to disable. Histogram buckets are upper bounds in seconds, with a final bucket for anything slower
+metrics_path = "~/.wikibot_metrics.json"
+metrics_interval = 60
+metrics_buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+metrics = {"start": time.time(), "written": 0, "counters": collections.Counter(), "histograms": {}}
+metrics_lock = threading.Lock()
+
+#Snapshots of sessions and the ingestion state that survive restarts. Sessions changed since the last snapshot are written every
+#snapshot_interval seconds. Set to None to disable
+session_db_path = "~/.wikibot_sessions.db"
+session_db = None
+snapshot_interval = 5
+snapshot_state = {"time": 0, "ingest": None}
+
+#On restart, messages that arrived while the bot was down are answered if they're at most catchup_max_age seconds old
+catchup_max_age = 600
+
+#Guards the session store. Each user's session is only modified by the one worker handling that user
+wiki_lock = threading.RLock()
+
+#Pending messages for each chat currently being handled by a worker, in arrival order
+user_queues = {}
+queue_lock = threading.Lock()
+worker_pool = None
+
+#Replies waiting to be sent, as (user, text) tuples
+send_queue = queue.Queue()
 
 #
 # Core functions
 #
 
 def main():
+    #Build offline corpus from dump file
+    if len(sys.argv) == 3 and sys.argv[1].lower() == "ingest":
+        return build_corpus(sys.argv[2])
+
     #Jump to command line mode if CLI flag was passed
     if sys.argv[-1].lower() == "cli":
         return cli()
 
-    #Connect to local iMessage database
-    conn = sqlite3.connect(os.path.expanduser(chat_db_path))
-    cur = conn.cursor()
+    #Worker threads for running commands of different chats concurrently
+    global worker_pool
+    worker_pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+    threading.Thread(target=run_sender, daemon=True).start()
 
-    #Get starting ROWID
-    rowid = 1 + cur.execute(sql_max_rowid).fetchone()[0]
+    cur = open_chat_db()
+    title_index_open()
     print("Database loaded! Waiting for new messages.")
 
     #Main loop - Monitor chat db for new messages and send responses
-    while True:
-        #Attempt to load new message from chat.db
-        new_data = cur.execute(sql_get_new + str(rowid)).fetchone()
+    db_path = os.path.expanduser(chat_db_path)
+    delay = poll_min_delay
+    try:
+        while True:
+            snapshot_sessions()
+            write_metrics()
+
+            #Take file signature before querying so that any write after the query wakes the next wait
+            signature = db_signature(db_path)
+            messages = fetch_new_messages(cur)
+
+            #Nothing ready - sleep until the database changes or the fallback poll expires
+            if not messages:
+                if wait_for_change(db_path, signature, delay):
+                    delay = poll_min_delay
+                else:
+                    delay = min(delay * 2, poll_max_delay)
+                continue
+
+            delay = poll_min_delay
+            for user, text in messages:
+                dispatch(text, user)
+    finally:
+        snapshot_sessions(force=True)
+
+#Connect to local iMessage database (read-only, the bot never writes to it) and start reading after the newest existing message,
+#or after the saved cursor when restarting
+def open_chat_db():
+    conn = sqlite3.connect(f"file:{os.path.expanduser(chat_db_path)}?mode=ro", uri=True)
+    cur = conn.cursor()
 
-        #No new message or message hasnt finished downloading - wait 1 second and repeat
-        if new_data == None or any(col == None for col in new_data[:-1]):
-            time.sleep(1)
+    newest = cur.execute(sql_max_rowid).fetchone()[0] or 0
+    ingest_state["cursor"] = newest
+    ingest_state["parked"].clear()
+
+    #Warm restart: catch up on messages from while the bot was down, skipping ones too old to still be worth answering.
+    #A saved cursor past the newest message means chat.db was replaced, so it's ignored
+    saved = load_snapshot()
+    if saved != None and saved["cursor"] <= newest:
+        newest_date = (cur.execute(sql_newest_date).fetchone() or [None])[0]
+        cutoff = (time.time() - apple_epoch - catchup_max_age) * apple_date_scale(newest_date)
+        stale = cur.execute(sql_max_rowid_before, (cutoff,)).fetchone()[0] or 0
+        ingest_state["cursor"] = max(saved["cursor"], stale)
+        ingest_state["parked"].update((rowid, time.time()) for rowid in saved["parked"] if rowid > stale)
+        log(f"Restored {len(wiki_data)} sessions, catching up from message {ingest_state['cursor']} to {newest}")
+
+    return cur
+
+#Pull every pending row above the cursor plus any parked rows, returning a list of (user, text) for messages that are ready
+def fetch_new_messages(cur):
+    rows = cur.execute(sql_get_new, (ingest_state["cursor"], ingest_batch_size)).fetchall()
+    if rows:
+        ingest_state["cursor"] = rows[-1][0]
+
+    #Retry rows that were still downloading on a previous poll
+    parked = ingest_state["parked"]
+    if parked:
+        placeholders = ",".join("?" * len(parked))
+        rows = cur.execute(sql_get_parked.format(placeholders), list(parked)).fetchall() + rows
+
+    messages = []
+    now = time.time()
+    for rowid, handle, text, is_from_me, room_name, date in rows:
+        #If message is from bot itself, ignore it
+        if is_from_me == 1:
+            parked.pop(rowid, None)
             continue
 
-        #Load contents into variables and update rowid
-        handle, text, is_from_me, room_name = new_data
-        rowid += 1
-
-        #If latest message is from bot itself, ignore it
-        if is_from_me == 1:
+        #Message hasn't finished downloading - park it without holding up the rows after it
+        if handle == None or text == None:
+            first_seen = parked.setdefault(rowid, now)
+            if now - first_seen > ingest_park_timeout:
+                del parked[rowid]
+                log(f"Gave up on message {rowid} after {ingest_park_timeout} seconds")
             continue
 
+        parked.pop(rowid, None)
+        count("messages")
+
+        #Time from message arriving in chat.db to being read
+        if date:
+            observe("intake_lag", now - date / apple_date_scale(date) - apple_epoch)
+
         #If group chat: "iMessage;+;[group chat ID]", otherwise: "iMessage;-;[phone #]"
         user = group_chat_prefix + room_name if room_name else direct_chat_prefix + handle
+        messages += [(user, text)]
 
-        #Form response message
+    return messages
+
+#Units per second of a chat.db date (see apple_seconds_max) - Internal use only
+def apple_date_scale(date):
+    return 1 if date != None and date < apple_seconds_max else 1e9
+
+#Get (mtime, size) of chat.db and its -wal/-shm files, plus the WAL frame count and change counter from the WAL index header
+def db_signature(db_path):
+    signature = []
+    for suffix in ("", "-wal", "-shm"):
         try:
-            response = get_response(text, user)
+            info = os.stat(db_path + suffix)
+            signature += [info.st_mtime_ns, info.st_size]
+        except OSError:
+            signature += [None, None]
+
+    #WAL index header (start of the -shm file, native byte order): iChange at byte 8, mxFrame at byte 16
+    try:
+        with open(db_path + "-shm", "rb") as file:
+            header = file.read(24)
+        signature += [struct.unpack_from("=I", header, 8)[0], struct.unpack_from("=I", header, 16)[0]]
+    except (OSError, struct.error):
+        signature += [None, None]
+
+    return tuple(signature)
+
+#Block until the database signature differs from the given one (returns True) or timeout seconds pass (returns False)
+def wait_for_change(db_path, signature, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if db_signature(db_path) != signature:
+            return True
+        time.sleep(watch_interval)
+
+    return False
+
+#Queue message for its chat (with the time it was queued), starting a worker for that chat if one isn't already running
+def dispatch(text, user):
+    with queue_lock:
+        if user in user_queues:
+            user_queues[user].append((text, time.time()))
+            return
+        user_queues[user] = collections.deque([(text, time.time())])
+
+    worker_pool.submit(drain_queue, user)
+
+#Worker: handle one chat's queued messages in order until its queue is empty
+def drain_queue(user):
+    while True:
+        with queue_lock:
+            if not user_queues[user]:
+                del user_queues[user]
+                return
+            text, queued = user_queues[user].popleft()
+            burst = take_burst(text, user)
+
+        observe("queue_wait", time.time() - queued)
+        try:
+            handle_message(text, user, burst)
         except Exception as err:
-            log(f"Unhandled exception creating response: {err}")
-            continue
+            log(f"Unhandled exception handling message: {err}")
 
-        #Nothing to send or bot is disabled - continue
-        if response == None:
-            continue
+#Pop navigation commands queued right behind msg for the same chat, if msg is one too. Caller must own the chat's queue
+def take_burst(msg, user):
+    burst = []
+    pending = user_queues[user]
+    if coalesce_bursts and navigation_command(msg, user) != None:
+        while pending and navigation_command(pending[0][0], user) != None:
+            burst += [pending.popleft()[0]]
 
-        #Hard limit on length in case a long message is sent erroneously
-        if len(response) > IMSG_HARD_LIMIT:
-            response = response[:IMSG_HARD_LIMIT - 2] + "..."
-            log("iMessage hard limit exceeded")
+    return burst
 
-        #Send iMessage via Applescript. Using "on run()" to pass in response & user is safer than building a single "tell" statement
-        subprocess.run(["osascript",
-                        "-e", "on run(msg, target)",
-                        "-e", "tell application \"Messages\" to send msg to chat id target",
-                        "-e", "end run",
-                        response, user])
+#Form and send response to a single incoming message, or one response to it and the burst of navigation commands after it
+def handle_message(text, user, burst=()):
+    start = time.perf_counter()
+    try:
+        response = get_burst_response([text] + burst, user) if burst else get_response(text, user)
+    except Exception as err:
+        count("errors")
+        log(f"Unhandled exception creating response: {err}")
+        return
+    finally:
+        observe("response", time.perf_counter() - start)
+
+    #Nothing to send or bot is disabled
+    if response == None:
+        return
+
+    send_message(response, user)
+
+#Queue response to be sent to given chat
+def send_message(response, user):
+    #Hard limit on length in case a long message is sent erroneously
+    if len(response) > IMSG_HARD_LIMIT:
+        response = response[:IMSG_HARD_LIMIT - 2] + "..."
+        log("iMessage hard limit exceeded")
+
+    send_queue.put((user, response))
 
 #Command-line interface mode for testing
 def cli():
@@ -124,179 +465,1367 @@ def get_response(msg, user):
     if not enabled:
         return cmd_enable() if msg.lower() == "wikibot enable" else None
 
+    check_session(user)
+
+    #A number right after a search that missed picks one of the suggested titles
+    suggestions = pending_suggestions.pop(user, None)
+    if suggestions != None and cast_int(msg) != None and 1 <= cast_int(msg) <= len(suggestions):
+        return run_command("search", cmd_search, suggestions[cast_int(msg) - 1], user)
+
     #If msg can be cast to an int, interpret as a page link if on a disambiguation page, otherwise section number
     if user in wiki_data and cast_int(msg) != None:
-        return cmd_link(msg, user) if wiki_data[user]["disambig"] else cmd_sect(msg, user)
+        if wiki_data[user].article["disambig"]:
+            return run_command("link", cmd_link, msg, user)
+        return run_command("section", cmd_sect, msg, user)
 
-    #Separate command from arguments by splitting at first non-alphanumeric char (keeps all characters)
+    cmd_text, arg_text = split_command(msg)
+
+    #Admin-only commands look like any other unknown command to everyone else
+    if cmd_text not in commands or (commands[cmd_text].get("admin") and user not in admin_users):
+        return cached_render("not found", lambda: f"Command not found! Type {stylize_text('help', 'bold sans')} for a list of commands.")
+
+    #Run specified command using "commands" dictionary
+    return run_command(cmd_text, commands[cmd_text]["func"], arg_text, user).strip()
+
+#Run command function and time it under the command's name. A WikiError from a command that had to wait for the rest of its article
+#becomes the reply - Internal use only
+def run_command(name, func, arg, user):
+    start = time.perf_counter()
+    try:
+        return func(arg, user)
+    except WikiError as err:
+        return str(err)
+    finally:
+        observe("command." + name, time.perf_counter() - start)
+
+#Keep idle & excess sessions in check, and rebuild user's session if it was spilled. If its article can't be loaded anymore, drop it
+def check_session(user):
+    wiki_data.sweep(user)
+
+    if user in wiki_data and wiki_data.is_spilled(user):
+        try:
+            restore_session(wiki_data[user])
+        except WikiError as e:
+            log(f"Dropping session of {user}: {e}")
+            del wiki_data[user]
+
+#Separate command from arguments by splitting at first non-alphanumeric char (keeps all characters), and resolve aliases
+def split_command(msg):
     cmd_text, arg_text = re.split(r"(?![A-Za-z0-9])", msg, 1)
     cmd_text = cmd_text.lower()
-    arg_text = arg_text.lstrip()
+    return aliases.get(cmd_text, cmd_text), arg_text.lstrip()
+
+#Name of the navigation command msg runs, or None if it isn't one. Numbers are section jumps unless on a disambiguation page
+def navigation_command(msg, user):
+    msg = msg.strip()
+    if cast_int(msg) != None:
+        if user in pending_suggestions:
+            return None
+        session = wiki_data.sessions.get(user)
+        return "section" if session != None and session.article != None and not session.article["disambig"] else None
+
+    cmd_text, arg_text = split_command(msg)
+    if cmd_text in navigation_commands and not (cmd_text == "section" and arg_text == "?"):
+        return cmd_text
+    return None
+
+#Run burst of navigation commands, replying only to the last. Commands before the last jump to a section number can't change where
+#the burst ends up, so they're skipped, and next/previous commands before the last command only move the position without rendering
+def get_burst_response(msgs, user):
+    if not enabled:
+        return None
 
-    #Resolve aliases
-    if cmd_text in aliases:
-        cmd_text = aliases[cmd_text]
+    count("coalesced", len(msgs) - 1)
+    for i in reversed(range(len(msgs))):
+        cmd_text, arg_text = split_command(msgs[i].strip())
+        if cast_int(msgs[i]) != None or (cmd_text == "section" and cast_int(arg_text) != None):
+            msgs = msgs[i:]
+            break
 
-    if cmd_text not in commands:
-        return f"Command not found! Type {stylize_text('help', 'bold sans')} for a list of commands."
+    check_session(user)
+    for msg in msgs[:-1]:
+        cmd_text = navigation_command(msg, user)
+        try:
+            if user in wiki_data and cmd_text == "next":
+                next_chunk(user)
+                track_section(user)
+            elif user in wiki_data and cmd_text == "previous":
+                prev_chunk(user)
+                track_section(user)
+            else:
+                get_response(msg, user)
+        except WikiError as err:
+            return str(err)
+
+    return get_response(msgs[-1], user)
 
-    #Run specified command using "commands" dictionary
-    response = commands[cmd_text]["func"](arg_text, user)
-    return response.strip()
+#
+# Outbound transports
+#
+
+#Sender thread: hands queued replies to the transport. Each batch holds at most one message per chat, and a failed message is
+#retried before anything queued after it for the same chat, so per-chat ordering holds while different chats are pipelined together
+def run_sender():
+    send_batch = transports[transport_name]["send"]
+    pending = {}
+    retry = False
+    while True:
+        #Block for new replies when idle, or wait out the retry delay after a failure. Then grab everything else that's queued
+        items = []
+        try:
+            if not pending:
+                items += [send_queue.get()]
+            elif retry:
+                items += [send_queue.get(timeout=send_retry_delay)]
+            while True:
+                items += [send_queue.get_nowait()]
+        except queue.Empty:
+            pass
+
+        for user, text in items:
+            pending.setdefault(user, collections.deque()).append([text, 0])
+
+        #Send first waiting message of each chat
+        batch = [(user, msgs[0][0]) for user, msgs in pending.items()]
+        start = time.perf_counter()
+        try:
+            results = send_batch(batch)
+        except Exception as err:
+            log(f"Transport error: {err}")
+            results = [False] * len(batch)
+        observe("send", time.perf_counter() - start)
+        count("sent", sum(results))
+
+        retry = not all(results)
+        for (user, text), sent in zip(batch, results):
+            msgs = pending[user]
+            if not sent:
+                msgs[0][1] += 1
+                count("send_failures")
+                if msgs[0][1] <= send_max_retries:
+                    continue
+                count("send_dropped")
+                log(f"Dropping message to {user} after {send_max_retries} retries")
+
+            msgs.popleft()
+            if not msgs:
+                del pending[user]
+
+#JXA script for the long-lived iMessage sender. Reads one JSON request per line from stdin and answers "ok" or "error" per line.
+#Requests are ASCII-only JSON, so lines can be split at any byte boundary when read
+imsg_sender_script = """
+ObjC.import("Foundation");
+var app = Application("Messages");
+var input = $.NSFileHandle.fileHandleWithStandardInput;
+var output = $.NSFileHandle.fileHandleWithStandardOutput;
+var buffer = "";
+while (true) {
+    var data = input.availableData;
+    if (data.length == 0) break;
+    buffer += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+    var lines = buffer.split("\\n");
+    buffer = lines.pop();
+    lines.forEach(function(line) {
+        var result = "ok";
+        try {
+            var req = JSON.parse(line);
+            app.send(req.msg, {to: app.chats.byId(req.target)});
+        } catch (err) {
+            result = "error";
+        }
+        output.writeData($(result + "\\n").dataUsingEncoding($.NSUTF8StringEncoding));
+    });
+}
+"""
+imsg_sender = None
+imsg_acks = b""
+
+#Send batch of (user, text) through the persistent osascript process, pipelining all requests before reading acknowledgements
+def imsg_send(batch):
+    global imsg_sender, imsg_acks
+    if imsg_sender == None or imsg_sender.poll() != None:
+        imsg_sender = subprocess.Popen(["osascript", "-l", "JavaScript", "-e", imsg_sender_script],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        imsg_acks = b""
+
+    results = []
+    try:
+        #Unbuffered pipe, so keep writing until everything is taken
+        data = "".join(json.dumps({"target": user, "msg": text}) + "\n" for user, text in batch).encode()
+        while data:
+            data = data[imsg_sender.stdin.write(data):]
+
+        for i in range(len(batch)):
+            results += [read_ack() == b"ok"]
+        return results
+
+    #Restart the sender on the next batch. Anything unacknowledged is treated as failed and retried
+    except (OSError, ValueError, EOFError) as err:
+        log(f"iMessage sender failed: {err}")
+        imsg_sender.kill()
+        return results + [False] * (len(batch) - len(results))
+
+#Read next acknowledgement line from the sender. Acks are read straight from the pipe into imsg_acks, since select can't see lines
+#already sitting in a buffered reader - Internal use only
+def read_ack():
+    global imsg_acks
+    while b"\n" not in imsg_acks:
+        if not select.select([imsg_sender.stdout], [], [], send_timeout)[0]:
+            raise TimeoutError("sender stopped responding")
+        data = os.read(imsg_sender.stdout.fileno(), 4096)
+        if not data:
+            raise EOFError("sender exited")
+        imsg_acks += data
+
+    line, imsg_acks = imsg_acks.split(b"\n", 1)
+    return line.strip()
+
+#Append batch of (user, text) to outbox_path, one JSON object per line
+def file_send(batch):
+    with open(outbox_path, "a") as file:
+        for user, text in batch:
+            file.write(json.dumps({"time": time.time(), "target": user, "msg": text}) + "\n")
+
+    return [True] * len(batch)
+
+#Available outbound transports, selected by transport_name
+transports = {
+    "imessage": {"send": imsg_send},
+    "file":     {"send": file_send}}
+
+#
+# Session store
+#
+
+#Compact per-user session. "article", "text" and "spans" refer to the shared article and the section (or whole article) being read,
+#and are dropped when the session is spilled. The rest (title, position & chunk offsets) is enough to rebuild it
+class Session:
+    __slots__ = ("title", "article", "section_num", "text", "spans", "all", "chunks", "chunk_num", "limit", "last_used", "matches")
+
+    def __init__(self, title, limit, article=None):
+        self.title = title
+        self.article = article
+        self.section_num = 0
+        self.text = None
+        self.spans = None
+        self.all = False
+        self.chunks = None
+        self.chunk_num = 0
+        self.limit = limit
+        self.last_used = time.time()
+        self.matches = None
+
+#Dict-like store of user sessions. Evicts idle sessions and spills least recently used ones to stay within the memory budget.
+#Users whose sessions were used, added or removed since the last snapshot are tracked in "changed"
+class SessionStore:
+    def __init__(self):
+        self.sessions = {}
+        self.changed = set()
+        self.last_sweep = time.time()
+
+    def __contains__(self, user):
+        return user in self.sessions
+
+    def __getitem__(self, user):
+        session = self.sessions[user]
+        session.last_used = time.time()
+        self.changed.add(user)
+        return session
+
+    def __setitem__(self, user, session):
+        with wiki_lock:
+            self.sessions[user] = session
+            self.changed.add(user)
+        self.sweep(user)
+
+    def __delitem__(self, user):
+        with wiki_lock:
+            del self.sessions[user]
+            self.changed.add(user)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    #Spilled sessions need restore_session before use
+    def is_spilled(self, user):
+        return self.sessions[user].article == None
+
+    #Evict idle sessions, then spill least recently used ones until article text held by sessions fits the budget. Sessions
+    #with messages being handled (and the current user's) are left alone. Runs at most once per session_sweep_interval unless forced
+    def sweep(self, current_user=None, force=False):
+        now = time.time()
+        if not force and now - self.last_sweep < session_sweep_interval:
+            return
+        self.last_sweep = now
+
+        with wiki_lock:
+            busy = set(user_queues) | {current_user}
+            for user, session in list(self.sessions.items()):
+                if now - session.last_used > session_ttl and user not in busy:
+                    del self.sessions[user]
+                    self.changed.add(user)
+
+            #Count each article once, however many sessions share it
+            holders = collections.Counter(id(s.article) for s in self.sessions.values() if s.article != None)
+            sizes = {id(s.article): article_bytes(s.article) for s in self.sessions.values() if s.article != None}
+            total = sum(sizes.values())
+
+            for user, session in sorted(self.sessions.items(), key=lambda item: item[1].last_used):
+                if total <= session_memory_budget:
+                    break
+                if session.article == None or user in busy:
+                    continue
+
+                key = id(session.article)
+                holders[key] -= 1
+                if holders[key] == 0:
+                    total -= sizes[key]
+
+                session.article = session.text = session.spans = None
+
+#Approximate memory held by an article's text (raw, formatted & concatenated) - Internal use only
+def article_bytes(article):
+    total = sum(sys.getsizeof(text) for text in article["sections"])
+    total += sum(sys.getsizeof(section[0]) for section in article.get("formatted", []) if section != None)
+    total += sys.getsizeof(article["all"][0]) if "all" in article else 0
+    total += sum(sys.getsizeof(offsets) for offsets in article["words"].values()) if "words" in article else 0
+    return total
+
+#Rebuild spilled session from shared cache, on-disk store, or API, keeping its place in the article
+def restore_session(session):
+    session.article = get_article(session.title)[0]
+
+    #Nothing loaded yet, just the article is needed
+    if session.chunks == None:
+        return
+
+    #Article may have been updated since, so stay within its sections and re-lay out chunks
+    if session.all:
+        session.text, starts, session.spans = get_all_text(session.article)
+    else:
+        session.section_num = min(session.section_num, len(session.article["sections"]) - 1)
+        session.text, session.spans = get_section(session.article, session.section_num)
+
+    session.chunks = layout_chunks(session.text, session.limit)
+    session.chunk_num = min(session.chunk_num, len(session.chunks) - 1)
+
+#Global variable that contains each user's session, i.e. their place in their article
+wiki_data = SessionStore()
+
+#
+# Session snapshots
+#
+
+#Open session snapshot database, creating its tables if needed. Returns None if snapshots are disabled - Internal use only
+def snapshot_open():
+    global session_db
+    if session_db == None and session_db_path != None:
+        session_db = sqlite3.connect(os.path.expanduser(session_db_path), check_same_thread=False)
+        session_db.execute("CREATE TABLE IF NOT EXISTS sessions (user TEXT PRIMARY KEY, title TEXT, section_num INTEGER,"
+                           " chunk_num INTEGER, all_text INTEGER, loaded INTEGER, char_limit INTEGER, last_used REAL)")
+        session_db.execute("CREATE TABLE IF NOT EXISTS ingest (id INTEGER PRIMARY KEY CHECK (id=0), cursor INTEGER, parked TEXT)")
+        session_db.commit()
+
+    return session_db
+
+#Write sessions changed since the last snapshot, and the ingestion state if it moved, in one transaction. Runs at most once per
+#snapshot_interval unless forced. Only called from the intake loop, which also owns ingest_state
+def snapshot_sessions(force=False):
+    now = time.time()
+    if not force and now - snapshot_state["time"] < snapshot_interval:
+        return
+    snapshot_state["time"] = now
+
+    db = snapshot_open()
+    if db == None:
+        return
+
+    #Grab positions of changed sessions. Positions are plain values, so copying them is all the lock is needed for
+    with wiki_lock:
+        changed, wiki_data.changed = wiki_data.changed, set()
+        rows = [(user, s.title, s.section_num, s.chunk_num, int(s.all), int(s.chunks != None), s.limit, s.last_used)
+                for user, s in ((user, wiki_data.sessions.get(user)) for user in changed) if s != None]
+    removed = [(user,) for user in changed if user not in wiki_data]
+
+    ingest = (ingest_state["cursor"], json.dumps(sorted(ingest_state["parked"])))
+    if not rows and not removed and ingest == snapshot_state["ingest"]:
+        return
+
+    try:
+        db.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        db.executemany("DELETE FROM sessions WHERE user=?", removed)
+        db.execute("INSERT OR REPLACE INTO ingest VALUES (0, ?, ?)", ingest)
+        db.commit()
+        snapshot_state["ingest"] = ingest
+    except sqlite3.Error as err:
+        log(f"Session snapshot failed: {err}")
+
+        #Try these sessions again next time
+        with wiki_lock:
+            wiki_data.changed |= changed
+
+#Load saved sessions as spilled sessions, so each is rebuilt when its user next sends a message. Returns the saved ingestion state
+#({"cursor", "parked"}), or None if there is none
+def load_snapshot():
+    db = snapshot_open()
+    if db == None:
+        return None
+
+    #Sessions that went idle past session_ttl while the bot was down are dropped
+    db.execute("DELETE FROM sessions WHERE last_used < ?", (time.time() - session_ttl,))
+    db.commit()
+
+    with wiki_lock:
+        for user, title, section_num, chunk_num, all_text, loaded, limit, last_used in db.execute(
+                "SELECT user, title, section_num, chunk_num, all_text, loaded, char_limit, last_used FROM sessions"):
+            session = Session(title, limit)
+            session.section_num = section_num
+            session.chunk_num = chunk_num
+            session.all = all_text == 1
+            session.chunks = [] if loaded == 1 else None
+            session.last_used = last_used
+            wiki_data.sessions[user] = session
+
+    row = db.execute("SELECT cursor, parked FROM ingest").fetchone()
+    if row == None:
+        return None
+
+    snapshot_state["ingest"] = row
+    return {"cursor": row[0], "parked": json.loads(row[1])}
+
+#
+# Metrics
+#
+
+#Add n to named counter
+def count(name, n=1):
+    with metrics_lock:
+        metrics["counters"][name] += n
+
+#Record duration (seconds) in named latency histogram
+def observe(name, seconds):
+    with metrics_lock:
+        if name not in metrics["histograms"]:
+            metrics["histograms"][name] = {"counts": [0] * (len(metrics_buckets) + 1), "count": 0, "sum": 0, "max": 0}
+
+        hist = metrics["histograms"][name]
+        hist["counts"][bisect.bisect_left(metrics_buckets, seconds)] += 1
+        hist["count"] += 1
+        hist["sum"] += seconds
+        hist["max"] = max(hist["max"], seconds)
+
+#Estimate q-th quantile of histogram as the upper bound of the bucket holding it, capped at the max - Internal use only
+def quantile(hist, q):
+    seen = 0
+    for i, bucket_count in enumerate(hist["counts"]):
+        seen += bucket_count
+        if seen >= q * hist["count"] and i < len(metrics_buckets):
+            return min(metrics_buckets[i], hist["max"])
+
+    return hist["max"]
+
+#Copy of counters & histograms, plus current queue depths and cache sizes
+def get_metrics():
+    with metrics_lock:
+        report = {"time": time.time(),
+                  "uptime": time.time() - metrics["start"],
+                  "buckets": metrics_buckets,
+                  "counters": dict(metrics["counters"]),
+                  "histograms": {name: dict(hist, counts=list(hist["counts"])) for name, hist in metrics["histograms"].items()}}
+
+    report["gauges"] = {"busy_chats": len(user_queues),
+                        "send_queue": send_queue.qsize(),
+                        "parked_messages": len(ingest_state["parked"]),
+                        "sessions": len(wiki_data),
+                        "cached_articles": len(article_cache)}
+    return report
+
+#Write metrics to metrics_path, replacing the previous file. Runs at most once per metrics_interval unless forced
+def write_metrics(force=False):
+    if metrics_path == None or (not force and time.time() - metrics["written"] < metrics_interval):
+        return
+    metrics["written"] = time.time()
+
+    path = os.path.expanduser(metrics_path)
+    try:
+        with open(path + ".tmp", "w") as file:
+            json.dump(get_metrics(), file, indent=1)
+        os.replace(path + ".tmp", path)
+    except OSError as err:
+        log(f"Couldn't write metrics: {err}")
 
 #
 # Command functions
 #
 
-#Request page via Wikipedia TextExtracts API and organize into and entry for wiki_data
+#Load article (from shared cache or Wikipedia) and make it the user's current article
 def cmd_search(title, user):
     if title == "":
         return cmd_help("search", user)
 
+    #Resolve case variants locally. Titles missing from a complete title index don't go to the API
+    resolved = resolve_title(title)
+    try:
+        try:
+            if resolved == None:
+                raise MissingPageError("Page does not exist! :-(")
+            article, redirected = get_article(resolved)
+
+        #Title index isn't complete: a title Wikipedia doesn't know may still be a case variant of a known one
+        except MissingPageError:
+            variant = None if title_index_complete else index_variant(title)
+            if variant == None:
+                raise
+            article, redirected = get_article(variant)
+    except MissingPageError as err:
+        return suggest_reply(str(err), title, user)
+    except WikiError as err:
+        return str(err)
+
+    #Non-cached article preview that displays after first retrieving an article
+    preview = "\n"
+
+    #Disambiguation page: add instructions (not cached)
+    if article["disambig"]:
+        preview += stylize_text("Enter an item number to be taken to its article\n\n", "italic sans")
+
+    #Normal article: add redirect notice if applicable
+    elif redirected:
+        preview += f"(Redirected from {title})\n\n"
+
+    #Use default character limit if user is new
+    new_limit = wiki_data[user].limit if user in wiki_data else default_limit
+
+    #Start new session pointing at the shared article
+    wiki_data[user] = Session(article["name"], new_limit, article)
+
+    #Article preview: Full text if disambiguation page, TOC for normal articles
+    preview += cmd_all("", user) if article["disambig"] else get_short_toc(user)
+
+    #Include total article length in kB at end of preview (not cached), estimated while the rest of the article is still arriving
+    if None not in article["sections"]:
+        total, about = len("".join(article["sections"])) / 1000, ""
+    else:
+        total, about = (article.get("length") or 0) * text_per_wikitext / 1000, "~"
+    if total > 0:
+        total = round(total, 1) if total < 10 else int(total)
+        preview += f"\n\nTotal: {about}{total} kB"
+
+    #Fetch the rest of the article, or likely next articles, in the background after the reply is ready
+    start_fill(article)
+    if article["disambig"]:
+        start_prefetch(article["links"], user)
+
+    #Display title and non-cached preview as first response
+    return article["title"] + preview
+
+#Error with a message meant to be sent back to the user
+class WikiError(Exception):
+    pass
+
+#WikiError for a title with no page, answered with suggestions from the title index
+class MissingPageError(WikiError):
+    pass
+
+#Get (article, redirected) for given search title from shared cache, then the on-disk store, fetching and parsing it on a miss.
+#Concurrent misses for the same title wait for the first one's lookup
+def get_article(title, whole=False):
+    article = cache_get(title)
+    if article != None:
+        count("cache_hits")
+        return article
+
+    count("cache_misses")
+    key = normalize_title(title)
+    with fetch_lock:
+        future = inflight_fetches.get(key)
+        first = future == None
+        if first:
+            future = inflight_fetches[key] = concurrent.futures.Future()
+
+    if not first:
+        count("shared_fetches")
+        return future.result()
+
+    try:
+        article = load_article(title, whole)
+        future.set_result(article)
+        return article
+    except BaseException as err:
+        future.set_exception(err)
+        raise
+    finally:
+        with fetch_lock:
+            del inflight_fetches[key]
+
+#Get (article, redirected) from the offline corpus, on-disk store, or API, and add it to the shared cache. If whole is True, the
+#API fetch is never progressive - Internal use only
+def load_article(title, whole=False):
+    article = corpus_get(title)
+    if article == None:
+        article = store_get(title)
+    if article == None:
+        article = fetch_article(title, whole)
+
+        #Progressively fetched articles are stored once they're complete, see fill_article
+        if "filled" not in article[0]:
+            store_put(title, *article)
+
+    #Raw extract is only kept on disk
+    article[0].pop("extract")
+    cache_put(title, *article)
+    return article
+
+#Send query to Wikipedia API and return its "query" object, raising WikiError with a user-facing message on failure. Missing pages
+#are only an error if missing_ok is False
+def api_query(params, missing_ok=False):
     #Set up wikipedia API query
-    wiki_url = "https://en.wikipedia.org/w/api.php"
     req_params = {
         "action": "query",
         "format": "json",
-        "prop": "extracts|pageprops",
-        "ppprop": "disambiguation",
-        "redirects" : "1",
-        "explaintext": "1",
-        "titles": title}
+        "redirects" : "1"}
+    req_params.update(params)
 
     #Get API response
     try:
-        req = requests.get(wiki_url, params=req_params, headers=req_header)
+        req = api_get(req_params)
     except Exception as err:
         log(err)
-        return "Wikipedia won't talk to me :'^("
+        raise WikiError("Wikipedia won't talk to me :'^(")
 
     #Check if response matches expected format
     try:
         json_data = req.json()["query"]
-        if int(list(json_data["pages"].keys())[0]) == -1:
-            return "Page does not exist! :-("
+        json_data["pages"].values()
+    except Exception as err:
+        log(err)
+        raise WikiError("I can't even tell what Wikipedia sent me =^(")
+
+    if int(list(json_data["pages"].keys())[0]) == -1 and not missing_ok:
+        raise MissingPageError("Page does not exist! :-(")
+
+    return json_data
+
+#Same as api_query() for a single title, but queries for other titles with the same params made within batch_window seconds are
+#sent along with it as one multi-title query, of up to max_titles (batch_max_titles by default). Each caller gets back the "query"
+#object for just its own page
+def batched_query(params, title, max_titles=None):
+    max_titles = max_titles or batch_max_titles
+
+    #The API separates titles with "|", so such a title can't share a query
+    if "|" in title:
+        return api_query(dict(params, titles=title))
+
+    key = tuple(sorted(params.items()))
+    with batch_lock:
+        batch = query_batches.get(key)
+        first = batch == None or len(batch["titles"]) >= max_titles
+        if first:
+            batch = query_batches[key] = {"titles": [], "future": concurrent.futures.Future()}
+        batch["titles"] += [title]
+
+    #First caller waits for others to join, then sends the query for everyone
+    if first:
+        time.sleep(batch_window)
+        with batch_lock:
+            if query_batches.get(key) is batch:
+                del query_batches[key]
+
+        count("batched_queries")
+        count("batched_titles", len(batch["titles"]))
+        try:
+            batch["future"].set_result(api_query(dict(params, titles="|".join(batch["titles"])), missing_ok=True))
+        except BaseException as err:
+            batch["future"].set_exception(err)
+
+    return split_query(batch["future"].result(), title)
+
+#Pick out page for given title from multi-title query response, following the API's title normalization & redirects - Internal use only
+def split_query(json_data, title):
+    name = title
+    for entry in json_data.get("normalized", []):
+        if entry["from"] == name:
+            name = entry["to"]
+
+    redirects = [entry for entry in json_data.get("redirects", []) if entry["from"] == name]
+    if redirects:
+        name = redirects[0]["to"]
+
+    for pageid, page in json_data["pages"].items():
+        if page["title"] == name and int(pageid) > 0:
+            split = {"pages": {pageid: page}}
+            if redirects:
+                split["redirects"] = redirects
+            return split
+
+    raise MissingPageError("Page does not exist! :-(")
+
+#GET from Wikipedia API through the shared session, with timeouts, retries, and circuit breaker. Returns the response
+def api_get(params):
+    with api_breaker_lock:
+        if time.time() < api_breaker["open_until"]:
+            count("api_rejected")
+            raise ConnectionError("circuit breaker open")
+
+    for attempt in range(api_max_retries + 1):
+        delay = api_retry_delay * 2 ** attempt * random.uniform(0.5, 1.5)
+        start = time.perf_counter()
+        try:
+            req = api_session.get(wiki_url, params=params, timeout=api_timeout)
+            observe("api", time.perf_counter() - start)
+
+            #Success, or a client error that retrying won't fix
+            if req.status_code != 429 and req.status_code < 500:
+                with api_breaker_lock:
+                    api_breaker["failures"] = 0
+                return req
+
+            error = requests.HTTPError(f"HTTP {req.status_code}")
+            retry_after = cast_int(req.headers.get("retry-after", ""))
+            if retry_after != None:
+                delay = min(retry_after, api_max_retry_after)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            observe("api", time.perf_counter() - start)
+            error = err
+
+        if attempt < api_max_retries:
+            count("api_retries")
+            time.sleep(delay)
+
+    #Out of retries: count failure, opening the breaker if too many in a row. After the cooldown, one failed trial call reopens it
+    count("api_failures")
+    with api_breaker_lock:
+        api_breaker["failures"] += 1
+        if api_breaker["failures"] >= api_breaker_threshold:
+            api_breaker["open_until"] = time.time() + api_breaker_cooldown
+            log(f"Wikipedia API failing, pausing calls for {api_breaker_cooldown} seconds")
+
+    raise error
+
+#Request page via Wikipedia TextExtracts API and organize it into an article_cache entry. Returns (article, redirected). Fetched
+#progressively (see fetch_intro) unless whole is True
+def fetch_article(title, whole=False):
+    if progressive_fetch and not whole:
+        return fetch_intro(title)
+    return fetch_full(title)
+
+#Fetch whole article from the API as (article, redirected) - Internal use only
+def fetch_full(title):
+    json_data = api_query({
+        "prop": "extracts|pageprops|info",
+        "ppprop": "disambiguation",
+        "explaintext": "1",
+        "titles": title})
 
+    article = page_article(json_data)
+
+    return parse_article(article), "redirects" in json_data
+
+#Raw article dict (name, extract, disambiguation flag, page ID & revision) from "query" object of an extracts query - Internal use only
+def page_article(json_data):
+    try:
         page_data = list(json_data["pages"].values())[0]
-        new_title = page_data["title"]
-        new_extract = page_data["extract"]
+        return {
+            "name": page_data["title"],
+            "extract": page_data["extract"],
+            "disambig": "pageprops" in page_data,
+            "pageid": page_data["pageid"],
+            "revid": page_data["lastrevid"],
+            "touched": page_data["touched"],
+            "length": page_data.get("length")}
     except Exception as err:
         log(err)
-        return "I can't even tell what Wikipedia sent me =^("
+        raise WikiError("I can't even tell what Wikipedia sent me =^(")
+
+#Fetch page info & introduction, and the section list. Returns (article, redirected) with None for each section yet to arrive, and
+#a "filled" future that's done once fill_article has put them in after start_fill. Falls back to the full article for disambiguation
+#pages, or if the section list can't be had - Internal use only
+def fetch_intro(title):
+    names = section_pool.submit(api_sections, title)
+    json_data = batched_query({
+        "prop": "extracts|pageprops|info",
+        "ppprop": "disambiguation",
+        "explaintext": "1",
+        "exintro": "1",
+        "exlimit": "max"}, title, intro_batch_max_titles)
 
-    #Non-cached article preview that displays after first retrieving an article
-    preview = "\n"
+    article = page_article(json_data)
 
-    #Check if this is a disambiguation page containing monstly links
+    try:
+        names = names.result()
+    except Exception as err:
+        log(f"Falling back to full fetch for {title}: {err}")
+        names = None
+    if article["disambig"] or names == None:
+        return fetch_full(title)
+
+    #Introduction, then placeholders for the other sections
+    parse_article(article)
+    article["toc"] += names
+    article["sections"] += [None] * len(names)
+    article["headers"] += [None] * len(names)
+    article["filled"] = concurrent.futures.Future()
+    article["fill_title"] = title
+    count("progressive_fetches")
+    return article, "redirects" in json_data
+
+#Start fetching the rest of a progressively fetched article in the background, unless it's already started or complete
+def start_fill(article):
+    title = article.pop("fill_title", None)
+    if title != None:
+        fill_pool.submit(fetch_full, title).add_done_callback(lambda full: fill_article(article, title, full))
+
+#Names of article's major sections, up to the final sections that arrive empty, from the API's parse of the page - Internal use only
+def api_sections(title):
+    req = api_get({
+        "action": "parse",
+        "format": "json",
+        "redirects": "1",
+        "prop": "sections",
+        "page": title})
+
+    names = []
+    for section in req.json()["parse"]["sections"]:
+        #Only ==Title== headers start a section, as in tokenize_extract
+        if section["level"] != "2":
+            continue
+
+        name = html.unescape(re.sub(r"<[^>]*>", "", section["line"])).strip()
+        if is_end_section(name):
+            break
+        names += [name]
+    return names
+
+#Put full article from the background fetch into progressively fetched article, and store it. Sessions already reading the article
+#see the new sections, and commands waiting on them are released - Internal use only
+def fill_article(article, title, full):
+    try:
+        new_article, redirected = full.result()
+        store_put(title, new_article, redirected)
+    except Exception as err:
+        log(f"Couldn't fill in {title}: {err}")
+        article["filled"].set_exception(err if isinstance(err, WikiError) else WikiError("Wikipedia won't talk to me :'^("))
+        return
+
+    new_article.pop("extract")
+    article.update(new_article)
+
+    #Drop anything memoized from the partial article
+    for key in ("formatted", "all", "words"):
+        article.pop(key, None)
+    article["filled"].set_result(True)
+
+#Wait for the rest of a progressively fetched article to arrive. Raises WikiError if it failed or takes too long - Internal use only
+def wait_filled(article):
+    start_fill(article)
+    count("section_waits")
+    start = time.perf_counter()
+    try:
+        article["filled"].result(progressive_wait)
+    except concurrent.futures.TimeoutError:
+        raise WikiError("The rest of the article is still loading, try again in a moment")
+    finally:
+        observe("section_wait", time.perf_counter() - start)
+
+#Organize raw article (name, extract & disambiguation flag) into TOC, sections, and links. Returns the same dict
+def parse_article(article):
+    start = time.perf_counter()
+    new_title = article["name"]
     new_links = []
-    new_disambig = "pageprops" in page_data
+    numbered = []
 
-    #Disambiguation page: split along page choices
-    if new_disambig:
-        new_extract, new_links = get_disambig_links(new_extract, new_title)
+    #Single pass over the extract for headers, plus page links if this is a disambiguation page
+    tree = tokenize_extract(article["extract"], article["disambig"])
 
-        #Add "disambiguation" to title along with instructions (not cached)
+    #Disambiguation page: find page choices
+    if article["disambig"]:
+        new_links, numbered = get_disambig_links(article["extract"], new_title, tree)
         new_title += " (Disambiguation)"
-        preview += stylize_text("Enter an item number to be taken to its article\n\n", "italic sans")
-
-    #Normal article: add redirect notice if applicable
-    elif "redirects" in json_data:
-        preview += f"(Redirected from {title})\n\n"
 
     #Split along major sections and extract TOC
-    new_toc, new_sections = organize_sections(new_extract)
-
-    #Use default character limit if user is new
-    new_limit = wiki_data[user]["limit"] if user in wiki_data else default_limit
+    new_toc, new_sections, new_headers = organize_sections(article["extract"], tree, numbered)
 
-    #Save page data into local cache for subsequent use
-    wiki_data.update({user: {
+    article.update({
         "title": stylize_text(new_title, "bold serif"),
         "toc": new_toc,
         "sections": new_sections,
-        "section_num": 0,
-        "limit": new_limit,
-        "disambig": new_disambig,
-        "links": new_links}})
+        "headers": new_headers,
+        "links": new_links,
+        "time": time.time()})
+
+    observe("parse", time.perf_counter() - start)
+    return article
+
+#Normalize search title the way the API does: underscores as spaces, collapsed whitespace, first letter capitalized
+def normalize_title(title):
+    title = " ".join(title.replace("_", " ").split())
+    return title[:1].upper() + title[1:]
+
+#Look up (article, redirected) for search title in shared cache. Returns None if missing or expired
+def cache_get(title):
+    with cache_lock:
+        key, redirected = title_aliases.get(normalize_title(title), (None, False))
+        article = article_cache.get(key)
+        if article == None or time.time() - article["time"] > article_cache_ttl:
+            return None
+
+        #Progressively fetched article whose remaining sections never arrived
+        if "filled" in article and article["filled"].done() and article["filled"].exception() != None:
+            return None
+
+        article_cache.move_to_end(key)
+        return article, redirected
+
+#Add article to shared cache under its resolved title, evicting least recently used entries past the size limit
+def cache_put(title, article, redirected):
+    key = article["name"]
+    with cache_lock:
+        article_cache[key] = article
+        article_cache.move_to_end(key)
+        title_aliases[normalize_title(title)] = (key, redirected)
+        title_aliases[normalize_title(key)] = (key, False)
+
+        while len(article_cache) > article_cache_size:
+            old_key, old_article = article_cache.popitem(last=False)
+            for alias in [alias for alias, (k, r) in title_aliases.items() if k == old_key]:
+                del title_aliases[alias]
+
+#Open on-disk article store, creating its tables if needed. Returns None if the store is disabled
+def store_open():
+    global article_db
+    if article_db == None and article_db_path != None:
+        article_db = sqlite3.connect(os.path.expanduser(article_db_path), check_same_thread=False)
+        article_db.execute("CREATE TABLE IF NOT EXISTS articles (pageid INTEGER PRIMARY KEY, revid INTEGER, touched TEXT,"
+                           " name TEXT, extract TEXT, disambig INTEGER, parse_version INTEGER, parsed TEXT)")
+        article_db.execute("CREATE TABLE IF NOT EXISTS titles (title TEXT PRIMARY KEY, pageid INTEGER, redirected INTEGER)")
+        article_db.commit()
+
+    return article_db
+
+#Look up (article, redirected) in on-disk store, revalidating the stored revision against the API. Returns None on a miss
+def store_get(title):
+    with store_lock:
+        db = store_open()
+        if db == None:
+            return None
+
+        row = db.execute("SELECT A.pageid, revid, touched, name, extract, disambig, parse_version, parsed, redirected"
+                         " FROM titles T JOIN articles A ON A.pageid=T.pageid WHERE T.title=?", (normalize_title(title),)).fetchone()
+
+    #Cheap revalidation: ask only for page info, and use stored copy if the page & revision are unchanged. If Wikipedia can't be
+    #reached, the stored copy is served as is
+    hit = False
+    if row != None:
+        pageid, revid, touched, name, extract, disambig, version, parsed, redirected = row
+        try:
+            info = list(batched_query({"prop": "info"}, title)["pages"].values())[0]
+            hit = info.get("pageid") == pageid and info.get("lastrevid") == revid
+        except MissingPageError:
+            raise
+        except WikiError:
+            count("store_unverified")
+            info = {"touched": touched}
+            hit = True
+
+    count("store_hits" if hit else "store_misses")
+    if not hit:
+        return None
 
-    #Article preview: Full text if disambiguation page, TOC for normal articles
-    preview += cmd_all("", user) if new_disambig else get_short_toc(user)
+    article = {"name": name, "extract": extract, "disambig": disambig == 1, "pageid": pageid, "revid": revid, "touched": info["touched"]}
 
-    #Include total article length in kB at end of preview (not cached)
-    total = len("".join(new_sections)) / 1000
-    total = round(total, 1) if total < 10 else int(total)
-    preview += f"\n\nTotal: {total} kB"
+    #Parsed results are reused unless the parser has changed since they were stored
+    if version == parse_version:
+        article.update(json.loads(parsed))
+        article["time"] = time.time()
+    else:
+        parse_article(article)
+        store_put(title, article, redirected == 1)
 
-    #Display title and non-cached preview as first response
-    return wiki_data[user]["title"] + preview
+    return article, redirected == 1
+
+#Save raw extract and parsed results to on-disk store, along with which search title leads to it
+def store_put(title, article, redirected):
+    parsed = json.dumps({key: article[key] for key in ("title", "toc", "sections", "headers", "links")})
+    with store_lock:
+        db = store_open()
+        if db == None:
+            return
 
-#Enumerate links and extract page names from disambiguation page text
-def get_disambig_links(extract, title):
-    #Chop off just before "see also" section
-    extract = extract.split("==.?See also.?==")[0].strip()
+        db.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   (article["pageid"], article["revid"], article["touched"], article["name"], article["extract"],
+                    int(article["disambig"]), parse_version, parsed))
+        db.execute("INSERT OR REPLACE INTO titles VALUES (?, ?, ?)", (normalize_title(title), article["pageid"], int(redirected)))
+        db.execute("INSERT OR REPLACE INTO titles VALUES (?, ?, 0)", (normalize_title(article["name"]), article["pageid"]))
+        db.commit()
+
+#Map offline corpus files into memory on first use. Returns None if there is no corpus - Internal use only
+def corpus_open():
+    with corpus_lock:
+        if "index" not in corpus:
+            corpus["index"] = None
+            path = os.path.expanduser(corpus_path) if corpus_path != None else None
+            if path != None and os.path.exists(path + ".idx") and os.path.exists(path + ".dat"):
+                with open(path + ".idx", "rb") as idx_file, open(path + ".dat", "rb") as dat_file:
+                    index = mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    data = mmap.mmap(dat_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path + ".dat") else b""
+
+                magic, version, entries = corpus_header.unpack_from(index)
+                if magic == b"WBCI" and version == 1:
+                    corpus.update({"index": index, "data": data, "entries": entries,
+                                   "titles": corpus_header.size + entries * corpus_entry.size})
+                    log(f"Offline corpus loaded: {entries} titles")
+
+        return corpus["index"]
+
+#Look up (article, redirected) in offline corpus by binary search over the title index. Returns None on a miss
+def corpus_get(title):
+    index = corpus_open()
+    if index == None:
+        return None
 
-    #Split along non-header text (doesnt start with '=') that's preceded by a newline and followed by a newline or comma
-    link_parts = re.split(r"(?<=\n)(?!\=)(.+?)(?=,|\n)", extract)
+    key = normalize_title(title).encode()
+    low, high = 0, corpus["entries"]
+    while low < high:
+        mid = (low + high) // 2
+        entry = corpus_entry.unpack_from(index, corpus_header.size + mid * corpus_entry.size)
+        if index[corpus["titles"] + entry[0]:corpus["titles"] + entry[0] + entry[1]] < key:
+            low = mid + 1
+        else:
+            high = mid
+
+    entry = corpus_entry.unpack_from(index, corpus_header.size + low * corpus_entry.size) if low < corpus["entries"] else None
+    hit = entry != None and index[corpus["titles"] + entry[0]:corpus["titles"] + entry[0] + entry[1]] == key
+    count("corpus_hits" if hit else "corpus_misses")
+    if not hit:
+        return None
 
-    #Extract page names into TOC, and number them in the article text. Even elements contain the text between page links
+    title_offset, title_length, offset, length, flags = entry
+    page = json.loads(zlib.decompress(corpus["data"][offset:offset + length]))
+    return parse_article({"name": page["title"], "extract": page["extract"], "disambig": page["disambig"]}), flags & corpus_redirect != 0
+
+#Build offline corpus from dump (JSON lines, optionally gzipped) of page objects and redirects, see corpus_path
+def build_corpus(dump_path):
+    path = os.path.expanduser(corpus_path)
+    entries = {}
+    redirects = {}
+
+    #Compress each page separately so it can be read on its own
+    with (gzip.open if dump_path.endswith(".gz") else open)(dump_path, "rt", encoding="utf-8") as dump, open(path + ".dat.tmp", "wb") as data:
+        for line in dump:
+            if line.strip() == "":
+                continue
+            page = json.loads(line)
+
+            if "redirect" in page:
+                redirects[normalize_title(page["title"])] = normalize_title(page["redirect"])
+                continue
+            if "extract" not in page:
+                continue
+
+            record = zlib.compress(json.dumps({"title": page["title"], "extract": page["extract"],
+                                               "disambig": "disambiguation" in page.get("pageprops", {})}).encode(), 9)
+            entries[normalize_title(page["title"])] = (data.tell(), len(record), 0)
+            data.write(record)
+
+    #Redirects point at their target's record. Redirects to missing pages are dropped, and pages take precedence over redirects
+    for source, target in redirects.items():
+        if target in entries and source not in entries:
+            entries[source] = entries[target][:2] + (corpus_redirect,)
+
+    #Index: header, fixed-size entries sorted by title, then the titles themselves
+    table = []
+    titles = []
+    titles_size = 0
+    for key in sorted(title.encode() for title in entries):
+        table += [corpus_entry.pack(titles_size, len(key), *entries[key.decode()])]
+        titles += [key]
+        titles_size += len(key)
+
+    with open(path + ".idx.tmp", "wb") as index:
+        index.write(corpus_header.pack(b"WBCI", 1, len(entries)) + b"".join(table) + b"".join(titles))
+
+    os.replace(path + ".dat.tmp", path + ".dat")
+    os.replace(path + ".idx.tmp", path + ".idx")
+
+    redirect_count = sum(1 for entry in entries.values() if entry[2] & corpus_redirect)
+    print(f"Corpus built: {len(entries) - redirect_count} pages, {redirect_count} redirects, "
+          f"{os.path.getsize(path + '.dat') / 1e6:.1f} MB")
+
+#Fold title for case-insensitive comparison - Internal use only
+def fold_title(title):
+    return " ".join(title.replace("_", " ").split()).casefold()
+
+#Set of trigrams in folded title, padded so that the start & end of the title count as well - Internal use only
+def title_trigrams(folded):
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+#Build title index on first use from the offline corpus and on-disk store: folded titles sorted for binary search, the titles in
+#the same order, and each trigram's positions in them for finding near misses
+def title_index_open():
+    with title_index_lock:
+        if "keys" in title_index:
+            return title_index
+
+        names = set()
+        index = corpus_open()
+        if index != None:
+            for entry in corpus_entry.iter_unpack(index[corpus_header.size:corpus["titles"]]):
+                names.add(index[corpus["titles"] + entry[0]:corpus["titles"] + entry[0] + entry[1]].decode())
+
+        with store_lock:
+            db = store_open()
+            if db != None:
+                names.update(normalize_title(name) for name, in db.execute("SELECT name FROM articles"))
+
+        pairs = sorted((fold_title(name), name) for name in names)
+        grams = {}
+        for position, (key, name) in enumerate(pairs):
+            for gram in title_trigrams(key):
+                grams.setdefault(gram, array.array("I")).append(position)
+
+        title_index.update({"keys": [key for key, name in pairs], "names": [name for key, name in pairs], "grams": grams})
+        if pairs:
+            log(f"Title index loaded: {len(pairs)} titles")
+        return title_index
+
+#Title to look up for search title. Unless the title index is complete, that's the title unchanged for the API to check (see
+#index_variant for when it's missing). With a complete index, it's the title if it's in the index, its only case variant there, or
+#None if it has none or several
+def resolve_title(title):
+    if not title_index_complete:
+        return title
+
+    variants = title_variants(title)
+    if normalize_title(title) in variants:
+        return title
+    return index_variant(title)
+
+#Only case variant of title in the title index, or None if it has none or several
+def index_variant(title):
+    variants = title_variants(title)
+    if len(variants) != 1:
+        return None
+
+    count("title_index_resolved")
+    return variants[0]
+
+#Titles in the title index that only differ from title by case - Internal use only
+def title_variants(title):
+    index = title_index_open()
+    folded = fold_title(title)
+    start = bisect.bisect_left(index["keys"], folded)
+    return index["names"][start:bisect.bisect_right(index["keys"], folded, start)]
+
+#Up to suggestion_count known titles closest to search title: titles starting with it (shortest first), then near misses sharing
+#the most trigrams with it, ranked by similarity
+def suggest_titles(title):
+    index = title_index_open()
+    keys, names = index["keys"], index["names"]
+    folded = fold_title(title)
+    if folded == "":
+        return []
+
+    prefixed = []
+    position = bisect.bisect_left(keys, folded)
+    while position < len(keys) and keys[position].startswith(folded) and len(prefixed) < 200:
+        prefixed += [position]
+        position += 1
+    prefixed.sort(key=lambda position: len(keys[position]))
+
+    shared = collections.Counter()
+    for gram in title_trigrams(folded):
+        shared.update(index["grams"].get(gram, ()))
+
+    matcher = difflib.SequenceMatcher(None, b=folded)
+    similar = []
+    for position, n in shared.most_common(suggestion_count * 4):
+        #Quick upper bounds first, since the full ratio is by far the slowest step
+        matcher.set_seq1(keys[position])
+        if matcher.real_quick_ratio() >= suggestion_cutoff and matcher.quick_ratio() >= suggestion_cutoff:
+            ratio = matcher.ratio()
+            if ratio >= suggestion_cutoff:
+                similar += [(-ratio, position)]
+    similar.sort()
+
+    suggestions = []
+    for position in prefixed + [position for ratio, position in similar]:
+        if names[position] not in suggestions:
+            suggestions += [names[position]]
+    return suggestions[:suggestion_count]
+
+#Reply to search for a missing page, listing the closest known titles as numbered choices for the user to pick from
+def suggest_reply(message, title, user):
+    suggestions = suggest_titles(title)
+    if not suggestions:
+        return message
+
+    count("title_suggestions")
+    pending_suggestions[user] = suggestions
+    return (message + "\n\n" + stylize_text("Did you mean... Enter an item number to search for it", "italic sans") + "\n\n"
+            + "\n".join(f"{i + 1}. {name}" for i, name in enumerate(suggestions)))
+
+#Queue background fetches of a disambiguation page's first links into the shared cache, within the user's prefetch budget
+def start_prefetch(links, user):
+    for title in links[:prefetch_count]:
+        with prefetch_lock:
+            if prefetch_inflight[user] >= prefetch_per_user:
+                return
+            prefetch_inflight[user] += 1
+
+        prefetch_pool.submit(prefetch, title, user)
+
+#Worker: fetch article into shared cache unless it's already there
+def prefetch(title, user):
+    #Missing pages are expected here, and API failures are already logged by api_query
+    try:
+        #Nobody is waiting on a first reply, so fetch whole rather than progressively
+        if cache_get(title) == None:
+            get_article(title, whole=True)
+    except WikiError:
+        pass
+    except Exception as err:
+        log(f"Prefetch of {title} failed: {err}")
+    finally:
+        with prefetch_lock:
+            prefetch_inflight[user] -= 1
+            if prefetch_inflight[user] <= 0:
+                del prefetch_inflight[user]
+
+#Split extract into a tree of major sections in one pass. Each section holds its title, the (start, end) offsets of its text,
+#its subsection headers as (level, title, start, end), and if links=True, the (start, end) of each disambiguation page link
+def tokenize_extract(extract, links=False):
+    tree = [{"title": "Introduction", "start": 0, "end": len(extract), "headers": [], "links": []}]
+    for match in (header_link_regex if links else header_regex).finditer(extract):
+        #Page link
+        if links and match["link"] != None:
+            tree[-1]["links"] += [match.span("link")]
+
+        #Major section header (==Title==) closes previous section and starts a new one
+        elif len(match["eq"]) == 2:
+            tree[-1]["end"] = match.start()
+            tree += [{"title": match["head"].strip(), "start": match.end(), "end": len(extract), "headers": [], "links": []}]
+
+        #Subsection (===Title===) or sub-subsection (====Title====) header
+        else:
+            tree[-1]["headers"] += [(len(match["eq"]), match["head"].strip(), match.start(), match.end())]
+
+    return tree
+
+#Check for the final sections that arrive empty (see also/references), which end the article - Internal use only
+def is_end_section(title):
+    return "See also" in title or "References" in title
+
+#Enumerate links and extract page names from disambiguation page. Returns page names, and the offset in extract to number each one at
+def get_disambig_links(extract, title, tree):
     new_links = []
-    for i in range(1, len(link_parts), 2):
-        #Get page name but remove all double quotes
-        page_name = re.sub('"|“|”', '', link_parts[i])
+    numbered = []
+    for sect in tree:
+        #Stop just before "see also" section
+        if is_end_section(sect["title"]):
+            break
 
-        #If page name is just the article title, add the next group after its comma (comma in page name, ie a placename)
-        if page_name.lower() == title.lower():
-            new_match = re.search(r",(.+?)(?=,|\n)", link_parts[i + 1])
-            page_name += new_match.group() if new_match else ""
+        for i, (start, end) in enumerate(sect["links"]):
+            #Get page name but remove all double quotes
+            page_name = quotes_regex.sub("", extract[start:end])
 
-        #Add page name to TOC
-        new_links += [page_name]
+            #If page name is just the article title, add the next group after its comma (comma in page name, ie a placename)
+            if page_name.lower() == title.lower():
+                next_start = sect["links"][i + 1][0] if i + 1 < len(sect["links"]) else sect["end"]
+                new_match = placename_regex.search(extract, end, next_start)
+                page_name += new_match.group() if new_match else ""
 
-        #Insert numbering next to each page name, starting at 1
-        link_parts[i] = f"{str(len(new_links))}. {link_parts[i]}"
+            #Add page name to TOC, numbered starting at 1
+            new_links += [page_name]
+            numbered += [start]
 
-    #Recombine link_parts as new extract
-    return "".join(link_parts), new_links
+    return new_links, numbered
 
-#Organize page text from TextExtracts API into separate sections and titles - Internal use only
-def organize_sections(extract):
-    #Split by major sections (delimited by ==). Add section name "Introduction" at the start
-    sect_parts = ["Introduction"] + re.split(r"(?<!\=)==(?!\=)", extract)
+#Organize page text into separate sections and titles, inserting link numbers at given offsets. Also returns each section's header
+#offsets (relative to the section text), which get_section uses for formatting - Internal use only
+def organize_sections(extract, tree, numbered=()):
+    numbers = {start: i + 1 for i, start in enumerate(numbered)}
 
-    #Extract section titles and organize content up through the final sections that arrive empty (see also/references)
+    #Organize content up through the final sections that arrive empty (see also/references)
     new_toc = []
     new_sections = []
-    for i in range(0, len(sect_parts), 2):
-        sect_title = sect_parts[i].strip()
-        if "See also" in sect_title or "References" in sect_title:
+    new_headers = []
+    for sect in tree:
+        if is_end_section(sect["title"]):
             break
 
-        #Odd-indexed elements contain actual section text
-        sect_text = sect_parts[i + 1].strip()
-
-        #Turn subsection titles (===Title===) bold, and sub-subsection titles (====Title====) bold italic
-        sect_text = format_headers(sect_text, "===", "bold sans")
-        sect_text = format_headers(sect_text, "====", "bold italic sans")
-
-        new_toc += [sect_title]
-        new_sections += [stylize_text(sect_title.upper(), "bold serif") + "\n\n" + sect_text]
-
-    return new_toc, new_sections
-
-#Replaces wiki-formatted headers (==Title==, ===Title===, ====Title====) with stylized text and newlines
-def format_headers(extract, delimiter, style):
-    #Split strictly along header delimiter (=== or ====). Regex is used so === can be handled before ====
-    sub_parts = re.split(f"(?<!\\=){delimiter}(?!\\=)", extract)
-
-    #Strip each part and stylize every other to create formatted headers
-    for i in range(len(sub_parts)):
-        sub_parts[i] = sub_parts[i].strip()
-        if i % 2 == 1:
-            sub_parts[i] = "\n" + stylize_text(sub_parts[i], style)
-        elif i > 0 and sub_parts[i] == "":
-            sub_parts[i] = stylize_text("-subsection contains no text-", "italic sans")
-
-    return "\n".join(sub_parts)
+        #Copy section text piece by piece, inserting link numbers and tracking where headers land
+        marks = sorted([(start, None) for start, end in sect["links"] if start in numbers] +
+                       [(header[2], header) for header in sect["headers"]])
+        sect_text = ""
+        headers = []
+        pos = sect["start"]
+        for start, header in marks:
+            sect_text += extract[pos:start]
+            if header == None:
+                sect_text += f"{numbers[start]}. "
+                pos = start
+            else:
+                level, head, start, end = header
+                headers += [[level, head, len(sect_text), len(sect_text) + end - start]]
+                sect_text += extract[start:end]
+                pos = end
+        sect_text += extract[pos:sect["end"]]
+
+        #Strip surrounding whitespace, shifting header offsets to match
+        lead = len(sect_text) - len(sect_text.lstrip())
+        new_toc += [sect["title"]]
+        new_sections += [sect_text.strip()]
+        new_headers += [[[level, head, start - lead, end - lead] for level, head, start, end in headers]]
+
+    return new_toc, new_sections, new_headers
+
+#Get formatted text of given section number as (plain text, style spans), formatting it on first access and memoizing the result.
+#Text stays plain so it's stored compactly, styles are applied to just the chunk being sent (see render_chunk) - Internal use only
+def get_section(article, number):
+    if article["sections"][number] == None:
+        wait_filled(article)
+
+        #The full article's sections may not match the section list the partial one was given
+        if number >= len(article["sections"]):
+            raise WikiError("Section not found! It may have been removed since the article was first loaded")
+
+    formatted = article.setdefault("formatted", [None] * len(article["sections"]))
+    if formatted[number] == None:
+        title = article["toc"][number].upper()
+        sect_text, spans = format_headers(article["sections"][number], article["headers"][number])
+        shift = len(title) + 2
+        formatted[number] = (title + "\n\n" + sect_text,
+                             [(0, len(title), "bold serif")] + [(start + shift, end + shift, style) for start, end, style in spans])
+
+    return formatted[number]
+
+#Puts subsection headers (===Title===, ====Title====) at given offsets on their own lines. Returns text and (start, end, style) spans
+#of the headers to stylize
+def format_headers(sect_text, headers):
+    ends = [start for level, head, start, end in headers[1:]] + [len(sect_text)]
+    next_levels = [level for level, head, start, end in headers[1:]] + [None]
+
+    #Text before first header, then each header followed by its text
+    text = sect_text[:headers[0][2]].strip() if headers else sect_text
+    spans = []
+    for (level, head, start, end), next_start, next_level in zip(headers, ends, next_levels):
+        #Subsection titles bold, and sub-subsection titles bold italic
+        text += "\n\n"
+        spans += [(len(text), len(text) + len(head), "bold sans" if level == 3 else "bold italic sans")]
+        text += head
+
+        #Note subsections with no text, unless they only hold deeper subsections
+        sub_text = sect_text[end:next_start].strip()
+        if sub_text == "" and next_level in (None, level):
+            sub_text = "-subsection contains no text-"
+            spans += [(len(text) + 1, len(text) + 1 + len(sub_text), "italic sans")]
+        if sub_text != "":
+            text += "\n" + sub_text
+
+    #Strip surrounding whitespace, shifting spans to match
+    lead = len(text) - len(text.lstrip())
+    return text.strip(), [(start - lead, end - lead, style) for start, end, style in spans]
 
 #link command, used to open links via numerical input from a disambiguation page (not actually in cmd list)
 def cmd_link(msg, user):
@@ -305,31 +1834,33 @@ def cmd_link(msg, user):
         return "Please input a number"
 
     #Compare input to total number of saved links
-    total = len(wiki_data[user]["links"])
+    total = len(wiki_data[user].article["links"])
     if total == 0:
         return "There are no numbered links in this article!"
 
     if page_num > total or page_num < 1:
         return f"Please enter a value between 1 and {total}"
 
-    #Search for specified page title, found in TOC
-    return cmd_search(wiki_data[user]["links"][page_num - 1], user)
+    #Search for specified page title, found in TOC. Counts as a prefetch hit if it is already in the shared cache
+    title = wiki_data[user].article["links"][page_num - 1]
+    count("prefetch_hits" if cache_get(title) != None else "prefetch_misses")
+    return cmd_search(title, user)
 
 #Display article title and numbered table of contents
 def cmd_toc(arg, user):
     if user not in wiki_data:
         return no_article()
 
-    return wiki_data[user]["title"] + "\n" + get_highlight_toc(user)
+    return wiki_data[user].article["title"] + "\n" + get_highlight_toc(user)
 
 #Get enumerated table of contents only - Internal use only
 def get_short_toc(user):
-    return "\n".join([f"{i}. {name}" for i, name in enumerate(wiki_data[user]["toc"])])
+    return "\n".join([f"{i}. {name}" for i, name in enumerate(wiki_data[user].article["toc"])])
 
 #Get TOC with current section highlighted in bold - Internal use only
 def get_highlight_toc(user):
     toc_list = get_short_toc(user).split("\n")
-    num = wiki_data[user]['section_num']
+    num = wiki_data[user].section_num
 
     toc_list[num] = stylize_text(toc_list[num], "bold sans")
     return "\n".join(toc_list)
@@ -339,39 +1870,47 @@ def cmd_next(arg, user):
     if user not in wiki_data:
         return no_article()
 
+    next_chunk(user)
+
+    #Send requested section chunk
+    return get_current(user)
+
+#Move to next chunk, loading the next section at the end of the current one - Internal use only
+def next_chunk(user):
     #Haven't loaded any sections yet, start with Introduction
-    if "chunks" not in wiki_data[user]:
+    if wiki_data[user].chunks == None:
         load_sect(0, user)
 
     #End of section reached, load next section. Wraps around to beginning if needed.
-    elif wiki_data[user]["chunk_num"] >= len(wiki_data[user]["chunks"]) - 1:
-        new_sect_num = (wiki_data[user]["section_num"] + 1) % len(wiki_data[user]["sections"])
+    elif wiki_data[user].chunk_num >= len(wiki_data[user].chunks) - 1:
+        new_sect_num = (wiki_data[user].section_num + 1) % len(wiki_data[user].article["sections"])
         load_sect(new_sect_num, user)
 
     #Otherwise simply increment chunk number
     else:
-        wiki_data[user]["chunk_num"] += 1
-
-    #Send requested section chunk
-    return get_current(user)
+        wiki_data[user].chunk_num += 1
 
 #Get previous chunk in section, or start previous section
 def cmd_prev(arg, user):
     if user not in wiki_data:
         return no_article()
 
+    prev_chunk(user)
+
+    #Send requested section chunk
+    return get_current(user)
+
+#Move to previous chunk, loading the end of the previous section at the start of the current one - Internal use only
+def prev_chunk(user):
     #Haven't loaded any sections yet or beginning of section reached, start with final chunk of previous section
-    if "chunk_num" not in wiki_data[user] or wiki_data[user]["chunk_num"] <= 0:
-        new_sect_num = (wiki_data[user]["section_num"] - 1) % len(wiki_data[user]["sections"])
+    if wiki_data[user].chunks == None or wiki_data[user].chunk_num <= 0:
+        new_sect_num = (wiki_data[user].section_num - 1) % len(wiki_data[user].article["sections"])
         load_sect(new_sect_num, user)
-        wiki_data[user]["chunk_num"] = len(wiki_data[user]["chunks"]) - 1
+        wiki_data[user].chunk_num = len(wiki_data[user].chunks) - 1
 
     #Otherwise simply decrement chunk number
     else:
-        wiki_data[user]["chunk_num"] -= 1
-
-    #Send requested section chunk
-    return get_current(user)
+        wiki_data[user].chunk_num -= 1
 
 #Jump to specified major section
 def cmd_sect(arg, user):
@@ -380,7 +1919,7 @@ def cmd_sect(arg, user):
 
     #Return current section number with name highlighted in TOC
     if arg == "?":
-        return f"Currently in Section {wiki_data[user]['section_num']}\n\n{get_highlight_toc(user)}"
+        return f"Currently in Section {wiki_data[user].section_num}\n\n{get_highlight_toc(user)}"
 
     #Another way to get all sections. This feature should be removed if there are articles with single-word sections titled "All"
     if arg == "all":
@@ -392,8 +1931,8 @@ def cmd_sect(arg, user):
         num = max(num, 0)
 
         message = ""
-        if num >= len(wiki_data[user]["sections"]):
-            num = len(wiki_data[user]["sections"]) - 1
+        if num >= len(wiki_data[user].article["sections"]):
+            num = len(wiki_data[user].article["sections"]) - 1
             message = stylize_text(f"Section number too large, jumping to Section {num} instead", "italic sans") + "\n\n"
 
         load_sect(num, user)
@@ -401,56 +1940,208 @@ def cmd_sect(arg, user):
 
     #Find section by name
     arg = arg.lower()
-    for i, name in enumerate(wiki_data[user]["toc"]):
+    for i, name in enumerate(wiki_data[user].article["toc"]):
         if name.lower().startswith(arg):
             load_sect(i, user)
             return get_current(user)
 
     return "Section not found!\n\n" + get_short_toc(user)
 
-#Jump to specified section number and split into chunks using character limit - Internal use only
+#Jump to specified section number and lay out its chunks using character limit - Internal use only
 def load_sect(number, user):
-    #Special case -1: Concatenate sections and load these into the chunks
-    if number == -1:
-        #Sections separated by double newlines for disambiguation page, triple newline for normal article
-        newlines = "\n\n" if wiki_data[user]["disambig"] else "\n\n\n"
+    start = time.perf_counter()
+    session = wiki_data[user]
 
-        #Newlines plus invisible char <ascii 1> to help track section number in TOC
-        section = (newlines + chr(1)).join(wiki_data[user]["sections"])
+    #Special case -1: Load concatenated sections, starting at section 0
+    session.all = number == -1
+    if session.all:
+        session.text, starts, session.spans = get_all_text(session.article)
         number = 0
 
-        #For disambiguation pages, chop off "Introduction" text
-        if wiki_data[user]["disambig"]:
-            section = section.split("\n\n", 1)[-1]
-
     #Otherwise load specified section number
     else:
-        section = wiki_data[user]["sections"][number]
+        session.text, session.spans = get_section(session.article, number)
+
+    #Lay out chunks of the referenced section text
+    session.section_num = number
+    session.chunks = layout_chunks(session.text, session.limit)
+    session.chunk_num = 0
+    observe("chunking", time.perf_counter() - start)
+
+#Get whole article as one string, plus the offset where each section starts within it and its style spans. Memoized - Internal use only
+def get_all_text(article):
+    if "all" not in article:
+        #Sections separated by double newlines for disambiguation page, triple newline for normal article
+        newlines = "\n\n" if article["disambig"] else "\n\n\n"
+        sections = [get_section(article, i) for i in range(len(article["sections"]))]
+
+        #For disambiguation pages, chop off "Introduction" text
+        if article["disambig"]:
+            text, spans = sections[0]
+            cut = text.find("\n\n") + 2 if "\n\n" in text else 0
+            sections[0] = (text[cut:], [(start - cut, end - cut, style) for start, end, style in spans if start >= cut])
+
+        starts = [0]
+        for text, spans in sections[:-1]:
+            starts += [starts[-1] + len(text) + len(newlines)]
+
+        all_spans = [(start + offset, end + offset, style) for (text, spans), offset in zip(sections, starts) for start, end, style in spans]
+        article["all"] = (newlines.join(text for text, spans in sections), starts, all_spans)
+
+    return article["all"]
+
+#Split text into chunks of at most limit characters while avoiding cutting up words. Returns list of (start, end) offsets - Internal use only
+def layout_chunks(text, limit):
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + limit, len(text))
 
-    #Split section into chunks of specified max size, while avoiding cutting up words
-    chunks = re.findall(f"(.{{1,{wiki_data[user]['limit']}}})(?=\\b)", section, re.DOTALL)
+        #Back up to the last word boundary, unless the rest of the text fits. Cut mid-word only if the chunk is a single word
+        if end < len(text):
+            cut = end
+            while cut > start and is_word_char(text[cut - 1]) == is_word_char(text[cut]):
+                cut -= 1
+            end = cut if cut > start else end
 
-    #Add (i/n) postscripts after each chunk
-    n = len(chunks)
-    for i in range(n):
-        chunks[i] = chunks[i].rstrip() + f" ({i + 1}/{n})"
+        chunks += [(start, end)]
+        start = end
 
-    #Update wiki_data with new section chunks
-    wiki_data[user].update({"section_num": number, "chunks": chunks, "chunk_num": 0})
+    return chunks
 
-#Get text of current chunk - Internal use only
+#Same as regex \w - Internal use only
+def is_word_char(char):
+    return char.isalnum() or char == "_"
+
+#Get text of current chunk, with (i/n) postscript - Internal use only
 def get_current(user):
-    response = wiki_data[user]["chunks"][wiki_data[user]["chunk_num"]]
+    chunks = wiki_data[user].chunks
+    num = wiki_data[user].chunk_num
+    start, end = chunks[num]
+    response = render_chunk(wiki_data[user].text, wiki_data[user].spans, start, end).rstrip() + f" ({num + 1}/{len(chunks)})"
 
-    #If viewing article all at once, use chr(1)'s to update current section number
-    wiki_data[user]["section_num"] += response.count(chr(1))
+    track_section(user)
 
     #Include end-of-article postscript if applicable
-    if wiki_data[user]["section_num"] >= len(wiki_data[user]["sections"]) - 1 and wiki_data[user]["chunk_num"] >= len(wiki_data[user]["chunks"]) - 1:
+    if wiki_data[user].section_num >= len(wiki_data[user].article["sections"]) - 1 and num >= len(chunks) - 1:
         response += stylize_text("\n\n[END OF ARTICLE]", "bold sans")
 
     return response
 
+#Get text between start and end offsets with the style spans that fall in it applied - Internal use only
+def render_chunk(text, spans, start, end):
+    #Spans are sorted and don't overlap, so only the one before the first span starting in the chunk can reach into it
+    i = max(bisect.bisect_left(spans, (start,)) - 1, 0)
+
+    parts = []
+    pos = start
+    for span_start, span_end, style in spans[i:]:
+        if span_start >= end:
+            break
+        if span_end <= pos:
+            continue
+
+        span_start = max(span_start, pos)
+        span_end = min(span_end, end)
+        parts += [text[pos:span_start], stylize_text(text[span_start:span_end], style)]
+        pos = span_end
+
+    parts += [text[pos:end]]
+    return "".join(parts)
+
+#If viewing article all at once, update current section number to the section the current chunk ends in - Internal use only
+def track_section(user):
+    if wiki_data[user].all:
+        starts = get_all_text(wiki_data[user].article)[1]
+        end = wiki_data[user].chunks[wiki_data[user].chunk_num][1]
+        wiki_data[user].section_num = bisect.bisect_right(starts, end - 1) - 1
+
+#Find word or phrase in article, listing the sections & parts it appears in. With no argument, jump to the next match
+def cmd_find(arg, user):
+    if user not in wiki_data:
+        return no_article()
+
+    session = wiki_data[user]
+    words = [word.casefold() for word in word_regex.findall(arg)]
+    if not words:
+        return next_match(user) if session.matches else cmd_help("find", user)
+
+    matches = find_matches(session.article, words)
+    if not matches:
+        session.matches = None
+        return f"\"{arg}\" not found in this article"
+    session.matches = matches
+
+    #Group matches by section, numbering parts by the user's current limit
+    chunks = {}
+    parts = {}
+    for number, offset in matches:
+        if number not in chunks:
+            chunks[number] = layout_chunks(get_section(session.article, number)[0], session.limit)
+        parts.setdefault(number, []).append(bisect.bisect_right(chunks[number], (offset, float("inf"))))
+
+    response = f"{len(matches)} match{'es' if len(matches) > 1 else ''} for \"{arg}\"\n"
+    for number, nums in list(parts.items())[:find_max_sections]:
+        nums = sorted(set(nums))
+        response += f"\n{number}. {session.article['toc'][number]}: part{'s' if len(nums) > 1 else ''} {', '.join(map(str, nums))}"
+    if len(parts) > find_max_sections:
+        response += f"\n...and {len(parts) - find_max_sections} more sections"
+
+    return response + "\n\n" + stylize_text("Type find again to jump to the next match", "italic sans")
+
+#Jump to chunk holding the first match after the current chunk, wrapping around to the first match - Internal use only
+def next_match(user):
+    session = wiki_data[user]
+    i = bisect.bisect_left(session.matches, current_position(user))
+    i = i if i < len(session.matches) else 0
+
+    number, offset = session.matches[i]
+    load_sect(number, user)
+    session.chunk_num = bisect.bisect_right(session.chunks, (offset, float("inf"))) - 1
+    return stylize_text(f"Match {i + 1}/{len(session.matches)}", "italic sans") + "\n\n" + get_current(user)
+
+#Sorted (section number, offset) of each place words appear in a row in the article's formatted sections - Internal use only
+def find_matches(article, words):
+    index = get_word_index(article)
+    offsets = index.get(words[0], ())
+    matches = []
+    for i in range(0, len(offsets), 2):
+        number, offset = offsets[i], offsets[i + 1]
+        text = get_section(article, number)[0]
+        if len(words) == 1 or [found.group().casefold() for found, word in zip(word_regex.finditer(text, offset), words)] == words:
+            matches += [(number, offset)]
+    return matches
+
+#Inverted index of article's words (case-folded), mapping each to its (section number, offset) pairs as a flat array. Offsets are
+#into the formatted section text load_sect shows. Built on first use and kept with the article - Internal use only
+def get_word_index(article):
+    if "words" not in article:
+        words = {}
+        for number in range(len(article["sections"])):
+            for found in word_regex.finditer(get_section(article, number)[0]):
+                words.setdefault(found.group().casefold(), array.array("I")).extend((number, found.start()))
+        article["words"] = words
+
+    return article["words"]
+
+#End of user's current chunk as (section number, offset in that section's formatted text) - Internal use only
+def current_position(user):
+    session = wiki_data[user]
+    if session.chunks == None:
+        return (0, 0)
+
+    end = session.chunks[session.chunk_num][1]
+    if not session.all:
+        return (session.section_num, end)
+
+    #Whole article view: find section the chunk ends in. Disambiguation pages have the introduction's text cut from it
+    text, starts, spans = get_all_text(session.article)
+    number = bisect.bisect_right(starts, end - 1) - 1
+    offset = end - starts[number]
+    if number == 0 and session.article["disambig"]:
+        offset += len(get_section(session.article, 0)[0]) - (starts[1] - 2 if len(starts) > 1 else len(text))
+    return (number, offset)
+
 #Load entire article text into "chunks"
 def cmd_all(arg, user):
     if user not in wiki_data:
@@ -464,6 +2155,10 @@ def cmd_part(arg, user):
     if user not in wiki_data:
         return no_article()
 
+    #Part numbers refer to the current section, so lay it out if nothing has been loaded yet
+    if wiki_data[user].chunks == None:
+        load_sect(wiki_data[user].section_num, user)
+
     #Specific keywords
     arg = arg.lower()
     if "next".startswith(arg):
@@ -471,10 +2166,10 @@ def cmd_part(arg, user):
     if "previous".startswith(arg):
         return cmd_prev("", user)
     if "first".startswith(arg):
-        wiki_data[user]["chunk_num"] = 0
+        wiki_data[user].chunk_num = 0
         return get_current(user)
     if "last".startswith(arg):
-        wiki_data[user]["chunk_num"] = len(wiki_data[user]["chunks"]) - 1
+        wiki_data[user].chunk_num = len(wiki_data[user].chunks) - 1
         return get_current(user)
 
     #Find part by number. Unlike section numbers, part numbers start at 1 instead of 0
@@ -484,12 +2179,12 @@ def cmd_part(arg, user):
         message = ""
 
         #Cap part # request at maximum (final)
-        if num > len(wiki_data[user]["chunks"]):
-            num = len(wiki_data[user]["chunks"])
+        if num > len(wiki_data[user].chunks):
+            num = len(wiki_data[user].chunks)
             message = stylize_text(f"Part number too large, jumping to part {num} instead", "italic sans") + "\n\n"
 
         #Decrease by 1 to convert to zero based index
-        wiki_data[user]["chunk_num"] = num - 1
+        wiki_data[user].chunk_num = num - 1
         return message + get_current(user)
 
     #Give up message
@@ -502,7 +2197,7 @@ def cmd_limit(arg, user):
 
     #No arg passed - display current limit and some help text
     if arg == "":
-        return f"Current character limit is {wiki_data[user]['limit']}. Use " + \
+        return f"Current character limit is {wiki_data[user].limit}. Use " + \
                stylize_text("limit ", "bold sans") + stylize_text("value", "bold italic sans") + " to modify."
 
     #Interpret arg as number or keyword "default"
@@ -524,11 +2219,23 @@ def cmd_limit(arg, user):
     else:
         response = f"New character limit set to {new_lim}"
 
-    wiki_data[user]["limit"] = new_lim
-    return response + ". Change will take effect when a new section or article is loaded."
+    wiki_data[user].limit = new_lim
+
+    #Re-lay out current section around the start of the chunk being read
+    if wiki_data[user].chunks != None:
+        offset = wiki_data[user].chunks[wiki_data[user].chunk_num][0]
+        chunks = layout_chunks(wiki_data[user].text, new_lim)
+        wiki_data[user].chunks = chunks
+        wiki_data[user].chunk_num = bisect.bisect_right([start for start, end in chunks], offset) - 1
+
+    return response + ". Takes effect from your current position."
 
 #Error message when no article has been loaded first
 def no_article():
+    return cached_render("no article", render_no_article)
+
+#Render no_article message - Internal use only
+def render_no_article():
     style = "bold italic sans"
 
     #Include alias for "search" help text if it exists
@@ -568,6 +2275,14 @@ def cmd_help(arg, user):
     if arg in aliases and arg != "":
         arg = aliases[arg]
 
+    #Any arg that isn't a command gets the same response. Admin-only commands are left out of help
+    if (arg not in commands or commands[arg].get("admin")) and arg != "":
+        arg = None
+
+    return cached_render(("help", arg), lambda: render_help(arg))
+
+#Render help text for command name, "" for the command list, or None for the command list after an error - Internal use only
+def render_help(arg):
     #Help with specific command in list? Just return usage & examples for that command
     if arg in commands:
         info = commands[arg]
@@ -579,7 +2294,7 @@ def cmd_help(arg, user):
         return response
 
     #If some other arg was passed, give error message before listing command
-    elif arg != "":
+    elif arg == None:
         response = "Command not found!"
 
     #If no arg was passed, include additional instructions for the help command itself, then list commands
@@ -594,6 +2309,9 @@ def cmd_help(arg, user):
 
     #Pull command names and aliases from the respective dictionaries, along with their descriptions
     for cmd_name, info in commands.items():
+        if info.get("admin"):
+            continue
+
         response += "\n" + stylize_text(cmd_name, "bold sans")
 
         #Include alias if it exists. Only prints the first alias for each command
@@ -616,6 +2334,23 @@ def cmd_ping(arg, user):
 
     return "pong" + arg
 
+#Stats command (admin only): counters, queue depths, and latency of each stage since startup. Any arg filters stages by name
+def cmd_stats(arg, user):
+    report = get_metrics()
+    hours, minutes = divmod(int(report["uptime"]) // 60, 60)
+
+    response = f"Up {hours}h {minutes}m\n\n" + stylize_text("COUNTS", "bold sans")
+    for name, value in sorted(report["counters"].items()) + sorted(report["gauges"].items()):
+        response += f"\n{name}: {value}"
+
+    response += "\n\n" + stylize_text("LATENCY", "bold sans") + " p50／p99／max (n)"
+    for name, hist in sorted(report["histograms"].items()):
+        if arg.lower() in name:
+            response += (f"\n{name}: {format_seconds(quantile(hist, 0.5))}／{format_seconds(quantile(hist, 0.99))}／"
+                         f"{format_seconds(hist['max'])} ({hist['count']})")
+
+    return response
+
 #
 # Misc. utility functions
 #
@@ -624,6 +2359,12 @@ def cmd_ping(arg, user):
 def log(msg):
     print(time.strftime("%F %T") + f" - {msg}")
 
+#Short human-readable duration, e.g. 0.42ms, 250ms or 1.5s
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.1f}s"
+    return f"{seconds * 1000:.2f}ms" if seconds < 0.01 else f"{seconds * 1000:.0f}ms"
+
 #Attempt to cast text as integer
 def cast_int(text):
     try:
@@ -633,33 +2374,45 @@ def cast_int(text):
 
 #Stylize alphanumeric plain text into bold, italic, and/or serif using UTF-8 mathematical characters. Cannot italicize numbers.
 def stylize_text(text, style_name):
-    #syntax:  "style name":        [(0-9) , (A-Z) , (a-z) , [(exceptions initial)], [(exceptions final)]]
-    styles = {"bold sans":         [120764, 120211, 120205],
-              "italic sans":       [     0, 120263, 120257],
-              "bold italic sans":  [120764, 120315, 120309],
-              "bold serif":        [120734, 119743, 119737],
-              "italic serif":      [     0, 119795, 119789, [104], [8462]],
-              "bold italic serif": [120734, 119847, 119841],
-              "doublestruck":      [120744, 120055, 120049, [67, 72, 78, 80, 81, 82, 90], [8450, 8461, 8469, 8473, 8474, 8477, 8484]]}
-
-    #Load offset values based on style name
-    offsets = styles[style_name]
-
-    #Loop through each character and replace alphanumeric chars with stylized symbols
-    new_text = ""
-    for i in text:
-        id = ord(i)
-        if len(offsets) > 3 and id in offsets[3]:  #exceptions that cannot be found using a simple offset
-            id = offsets[4][offsets[3].index(id)]
-        elif id >= 48 and id <= 57:                # 0-9
-            id += offsets[0]
-        elif id >= 65 and id <= 90:                # A-Z
-            id += offsets[1]
-        elif id >= 97 and id <= 122:               # a-z
-            id += offsets[2]
-        new_text += chr(id)
-
-    return new_text
+    return text.translate(style_tables[style_name])
+
+#Build str.translate table from style offsets & exceptions - Internal use only
+def build_style_table(offsets):
+    table = {}
+    for first, last, offset in [(48, 57, offsets[0]),    # 0-9
+                                (65, 90, offsets[1]),    # A-Z
+                                (97, 122, offsets[2])]:  # a-z
+        if offset != 0:
+            table.update({id: id + offset for id in range(first, last + 1)})
+
+    #Exceptions that cannot be found using a simple offset
+    if len(offsets) > 3:
+        table.update(zip(offsets[3], offsets[4]))
+
+    return table
+
+#syntax:  "style name":        [(0-9) , (A-Z) , (a-z) , [(exceptions initial)], [(exceptions final)]]
+styles = {"bold sans":         [120764, 120211, 120205],
+          "italic sans":       [     0, 120263, 120257],
+          "bold italic sans":  [120764, 120315, 120309],
+          "bold serif":        [120734, 119743, 119737],
+          "italic serif":      [     0, 119795, 119789, [104], [8462]],
+          "bold italic serif": [120734, 119847, 119841],
+          "doublestruck":      [120744, 120055, 120049, [67, 72, 78, 80, 81, 82, 90], [8450, 8461, 8469, 8473, 8474, 8477, 8484]]}
+style_tables = {name: build_style_table(offsets) for name, offsets in styles.items()}
+
+#Get fixed response (help text, error messages) from render cache, rendering it on a miss. Cache is cleared whenever the
+#commands or aliases dictionaries have changed since it was filled
+def cached_render(key, render):
+    signature = (tuple(commands), tuple(aliases.items()))
+    if render_cache.get("signature") != signature:
+        render_cache.clear()
+        render_cache["signature"] = signature
+
+    if key not in render_cache:
+        render_cache[key] = render()
+
+    return render_cache[key]
 
 #Command list. Keys represent the text input, while values contain the function to call as well as help info
 commands = {
@@ -692,6 +2445,12 @@ commands = {
         "usage": stylize_text("part ", "bold sans") + stylize_text("number", "bold italic sans") + "\n\n" \
                  + "Alternatively use keywords next/previous/first/last",
         "examp": "part 3\npart last"},
+    "find": {
+        "func": cmd_find,
+        "desc": "Find a word or phrase in the article",
+        "usage": stylize_text("find ", "bold sans") + stylize_text("word／phrase", "bold italic sans") + "\n\n" + \
+                 "Lists the sections and parts it appears in. Type find on its own to jump to the next match.",
+        "examp": "find treaty\nfind"},
     "all": {
         "func": cmd_all,
         "desc": "Get entire article text, rather than split by sections"},
@@ -715,7 +2474,16 @@ commands = {
         "examp": "help search"},
     "ping": {
         "func": cmd_ping,
-        "desc": "Ping bot to check connection"}}
+        "desc": "Ping bot to check connection"},
+    "stats": {
+        "func": cmd_stats,
+        "desc": "Show bot metrics (admin only)",
+        "admin": True,
+        "usage": stylize_text("stats ", "bold sans") + stylize_text("stage name", "bold italic sans"),
+        "examp": "stats\nstats command"}}
+
+#Rendered fixed responses, see cached_render
+render_cache = {}
 
 #Short form aliases for the important commands. Only the first alias of a given command will show up in the help text
 aliases = {